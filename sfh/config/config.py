@@ -26,11 +26,17 @@ import enum
 import json
 import logging
 import configparser
+from threading import local
 from database.model import MatchRule
 from database.model import FileRelevance
 from database.model import SearchLocation
 from database.model import MatchRuleAccuracy
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 logger = logging.getLogger("config")
 
 
@@ -79,6 +85,7 @@ class FileHunter(BaseConfig):
         super().__init__("hunter.config")
         self.matching_rules = {}
         self.supported_archives = []
+        self.skipped_content_extensions = []
         self.threshold = self.get_config_int("general", "max_file_size_bytes")
         self.archive_threshold = self.get_config_int("general", "max_archive_size_bytes")
         self.kali_packages = json.loads(self.get_config_str("setup", "kali_packages"))
@@ -91,20 +98,95 @@ class FileHunter(BaseConfig):
                 self.matching_rules[rule.search_location.name].append(rule)
             except re.error:
                 logging.error("failed to compile regex: {}".format(match_rule["search_pattern"]))
-        # Add Microsoft Active Directory domain names to search list
+        # Add Microsoft Active Directory domain names to search list. all domain names are combined into one match
+        # rule so that the file contents are searched only once for all of them. the names are escaped as they are
+        # matched literally
         if domain_names:
-            for domain_name in domain_names:
-                match_rule = MatchRule(search_location=SearchLocation.file_content,
-                                       relevance=FileRelevance.medium,
-                                       accuracy=MatchRuleAccuracy.medium,
-                                       search_pattern="{}[\\\\/]\\w+".format(domain_name))
-                self.matching_rules[SearchLocation.file_content.name].append(match_rule)
+            domains = "|".join(re.escape(domain_name) for domain_name in domain_names)
+            match_rule = MatchRule(search_location=SearchLocation.file_content,
+                                   relevance=FileRelevance.medium,
+                                   accuracy=MatchRuleAccuracy.medium,
+                                   search_pattern="(?:{})[\\\\/]\\w+".format(domains))
+            self.matching_rules[SearchLocation.file_content.name].append(match_rule)
         # Sort matching rules according to their priority
         for key, value in self.matching_rules.items():
             self.matching_rules[key] = sorted(value, key=lambda rule: rule.priority, reverse=True)
+        self._path_name_patterns = {}
+        self._path_name_databases = {}
+        self._scratches = local()
+        for search_location in [SearchLocation.full_path, SearchLocation.file_name]:
+            rules = self.matching_rules.get(search_location.name, [])
+            self._path_name_patterns[search_location] = self._combine_rules(rules)
+            self._path_name_databases[search_location] = self._compile_rules(rules)
         for item in json.loads(self.get_config_str("general", "supported_archives")):
             if item not in self.supported_archives:
                 self.supported_archives.append(item.lower())
+        for item in json.loads(self.get_config_str("general", "skipped_content_extensions")):
+            if item not in self.skipped_content_extensions:
+                self.skipped_content_extensions.append(item.lower())
+
+    @staticmethod
+    def _combine_rules(rules: list):
+        """
+        This method combines the search patterns of the given match rules into one alternation with one named group per
+        rule. As path name rules are matched at the beginning of the path, the alternatives are tried in the order of
+        the given rules and the first matching alternative determines the matching rule.
+        :return: The compiled alternation or None, if the search patterns cannot be combined.
+        """
+        if not rules:
+            return None
+        try:
+            return re.compile(b"|".join(b"(?P<r" + str(index).encode() + b">" + rule.search_pattern.encode("utf-8") + b")"
+                                        for index, rule in enumerate(rules)), re.IGNORECASE)
+        except re.error:
+            logger.debug("failed to combine path name rules. they are matched one by one.")
+            return None
+
+    @staticmethod
+    def _compile_rules(rules: list):
+        """
+        This method compiles the search patterns of the given match rules into one hyperscan database, which reports
+        the indices of all rules that match at the beginning of a path.
+        :return: The hyperscan database or None, if hyperscan is not installed or does not support all search patterns.
+        """
+        if not hyperscan or not rules:
+            return None
+        try:
+            result = hyperscan.Database()
+            result.compile(expressions=[b"^(?:" + rule.search_pattern.encode("utf-8") + b")" for rule in rules],
+                           ids=list(range(len(rules))),
+                           flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(rules))
+            return result
+        except hyperscan.error:
+            logger.debug("hyperscan does not support all path name rules. they are matched by module re.")
+            return None
+
+    def find_path_name_rule(self, search_location: SearchLocation, path) -> MatchRule:
+        """
+        This method returns the first full path or file name match rule that matches the given path object.
+        :param search_location: Either SearchLocation.full_path or SearchLocation.file_name.
+        :param path: The path object whose full path or file name is analyzed.
+        :return: The matching rule with the highest priority or None, if no rule matches.
+        """
+        rules = self.matching_rules.get(search_location.name, [])
+        value = path.full_path if search_location == SearchLocation.full_path else path.file_name
+        database = self._path_name_databases.get(search_location)
+        if database is not None:
+            # hyperscan's scratch space must not be shared between threads
+            scratch = getattr(self._scratches, search_location.name, None)
+            if scratch is None:
+                scratch = hyperscan.Scratch(database)
+                setattr(self._scratches, search_location.name, scratch)
+            matches = []
+            database.scan(value.encode("utf-8"),
+                          match_event_handler=lambda index, start, end, flags, context: matches.append(index),
+                          scratch=scratch)
+            return rules[min(matches)] if matches else None
+        pattern = self._path_name_patterns.get(search_location)
+        if pattern is None:
+            return next((rule for rule in rules if rule.is_match(path)), None)
+        match = pattern.match(value.encode("utf-8"))
+        return rules[int(match.lastgroup[1:])] if match else None
 
     def is_archive(self, path) -> bool:
         """
@@ -112,10 +194,19 @@ class FileHunter(BaseConfig):
         """
         return path and path.extension and path.extension.lower() in self.supported_archives
 
+    def is_content_skipped(self, path) -> bool:
+        """
+        Returns true if the given path file has an extension in the self.skipped_content_extensions list.
+        """
+        return path and path.extension and path.extension.lower() in self.skipped_content_extensions
+
     def is_below_threshold(self, path, file_size: int) -> bool:
         """
-        This method determines if the given file size in bytes is below the configured threshold.
+        This method determines if the given file size in bytes is below the configured threshold. Files whose
+        content is skipped because of their extension are never below the threshold.
         """
+        if self.is_content_skipped(path):
+            return False
         is_archive = self.is_archive(path)
         return file_size > 0 and ((is_archive and (self.archive_threshold <= 0 or
                                                    file_size <= self.archive_threshold)) or
@@ -25,6 +25,7 @@ import pwd
 import tempfile
 import ipaddress
 import subprocess
+from sqlalchemy import func
 from sqlalchemy import create_engine
 from config.config import DatabaseFactory
 from sqlalchemy.ext.declarative import declarative_base
@@ -72,6 +73,11 @@ class Engine:
         """This method drops all views and tables in the database."""
         self._drop_tables()
 
+    def create_archive_tables(self) -> None:
+        """This method creates the archive tables, if they do not exist (e.g., in databases of earlier versions)."""
+        Archive.__table__.create(self.engine, checkfirst=True)
+        ArchiveMember.__table__.create(self.engine, checkfirst=True)
+
     def _create_tables(self) -> None:
         """This method creates all tables."""
         DeclarativeBase.metadata.create_all(self.engine)
@@ -187,6 +193,45 @@ class Engine:
                 session.flush()
         return workspace
 
+    def get_workspaces(self, session, names: list, ignore: bool = False) -> dict:
+        """
+        This method returns the workspaces with the given names using a single query.
+        :param session: Database session used to query the workspaces
+        :param names: The names of the workspaces
+        :param ignore: If true, then missing workspaces are created instead of raising WorkspaceNotFound
+        :return: Dictionary mapping each workspace name to its database object
+        """
+        result = {item.name: item for item in session.query(Workspace).filter(Workspace.name.in_(names)).all()}
+        missing = [name for name in dict.fromkeys(names) if name not in result]
+        if missing:
+            if not ignore:
+                raise WorkspaceNotFound("workspace '{}' not found.".format(missing[0]))
+            workspaces = [Workspace(name=name) for name in missing]
+            session.add_all(workspaces)
+            session.flush()
+            result.update({item.name: item for item in workspaces})
+        return result
+
+    @staticmethod
+    def get_known_paths(session, service: Service) -> dict:
+        """
+        This method returns the modification time and file size of all paths of the given service whose file content
+        is stored in the database.
+        :param session: Database session used to query the paths
+        :param service: The service whose paths shall be returned
+        :return: Dictionary mapping each (share, full path) tuple to the (modification time, file size) tuple
+        """
+        result = {}
+        # files above the threshold only store a placeholder, whose length differs from the file size
+        query = session.query(Path.share, Path._full_path, Path.modified_time, File.size_bytes) \
+            .join(File) \
+            .filter(Path.service_id == service.id,
+                    Path.modified_time.isnot(None),
+                    func.length(File._content) == File.size_bytes)
+        for share, full_path, modified_time, size_bytes in query:
+            result[(share or "", full_path)] = (modified_time, size_bytes)
+        return result
+
     @staticmethod
     def add_workspace(session, name) -> Workspace:
         """
@@ -271,15 +316,18 @@ class Engine:
     @staticmethod
     def get_path(session: Session,
                  service: Service,
-                 full_path: str) -> Path:
+                 full_path: str,
+                 service_id: int = None) -> Path:
         """
         This method should be used to obtain a path object from the database
         :param session: Sqlalchemy session that manages persistence operations for ORM-mapped objects
         :param service: The service object to which the path belongs
         :param full_path: The path that shall be returned
+        :param service_id: The primary key of the service to which the path belongs (alternative to service)
         :return: Database object
         """
-        return session.query(Path).filter_by(_full_path=full_path, service_id=service.id).one_or_none()
+        service_id = service_id if service_id else service.id
+        return session.query(Path).filter_by(_full_path=full_path, service_id=service_id).one_or_none()
 
     @staticmethod
     def add_path(session: Session,
@@ -289,7 +337,8 @@ class Engine:
                  share: str = None,
                  access_time: DateTime = None,
                  modified_time: DateTime = None,
-                 creation_time: DateTime = None) -> Path:
+                 creation_time: DateTime = None,
+                 service_id: int = None) -> Path:
         """
         This method should be used to add a path to the database
         :param session: Sqlalchemy session that manages persistence operations for ORM-mapped objects
@@ -299,17 +348,21 @@ class Engine:
         :param access_time: The file's last access time
         :param modified_time: The file's last modified time
         :param creation_time: The file's creation time
+        :param service_id: The primary key of the service to which the path belongs (alternative to service)
         :return: Database object
         """
-        result = Engine.get_path(session=session, service=service, full_path=full_path)
+        result = Engine.get_path(session=session, service=service, full_path=full_path, service_id=service_id)
         if not result:
-            result = Path(service=service,
-                          full_path=full_path,
+            result = Path(full_path=full_path,
                           file=file,
                           share=share,
                           access_time=access_time,
                           modified_time=modified_time,
                           creation_time=creation_time)
+            if service_id:
+                result.service_id = service_id
+            else:
+                result.service = service
             session.add(result)
             session.flush()
         return result
@@ -349,6 +402,39 @@ class Engine:
             session.flush()
         return result
 
+    @staticmethod
+    def get_archive(session: Session,
+                    workspace: Workspace,
+                    sha256_value: str) -> Archive:
+        """
+        This method should be used to obtain an already extracted archive from the database
+        :param session: Sqlalchemy session that manages persistence operations for ORM-mapped objects
+        :param workspace: The workspace to which the archive belongs
+        :param sha256_value: The sha256 value of the archive file
+        :return: Database object
+        """
+        return session.query(Archive).filter_by(sha256_value=sha256_value, workspace_id=workspace.id).one_or_none()
+
+    @staticmethod
+    def add_archive(session: Session,
+                    workspace: Workspace,
+                    sha256_value: str,
+                    members: List[ArchiveMember]) -> Archive:
+        """
+        This method should be used to add an extracted archive together with its relevant members to the database
+        :param session: Sqlalchemy session that manages persistence operations for ORM-mapped objects
+        :param workspace: The workspace to which the archive belongs
+        :param sha256_value: The sha256 value of the archive file
+        :param members: The archive's members whose files are stored in the database
+        :return: Database object
+        """
+        result = Engine.get_archive(session=session, workspace=workspace, sha256_value=sha256_value)
+        if not result:
+            result = Archive(workspace_id=workspace.id, sha256_value=sha256_value, members=members)
+            session.add(result)
+            session.flush()
+        return result
+
     @staticmethod
     def get_match_rule(session: Session,
                        search_location: SearchLocation,
@@ -393,3 +479,28 @@ class Engine:
             result.category = category
         return result
 
+    @staticmethod
+    def add_match_rules(session: Session, match_rules: List[MatchRule]) -> None:
+        """
+        This method should be used to add many match rules to the database at once. The existing match rules are
+        queried with a single SQL statement and all missing match rules are inserted in bulk.
+        :param session: Sqlalchemy session that manages persistence operations for ORM-mapped objects
+        :param match_rules: The match rules (e.g., of the configuration file), which are not bound to any session
+        """
+        existing = {(item._search_location, item._search_pattern): item for item in session.query(MatchRule).all()}
+        mappings = {}
+        for match_rule in match_rules:
+            key = (match_rule.search_location.value, match_rule.search_pattern)
+            result = existing.get(key)
+            if result is None:
+                # duplicate rules are only inserted once
+                mappings.setdefault(key, {"_search_location": key[0],
+                                          "_search_pattern": key[1],
+                                          "_relevance": match_rule.relevance.value,
+                                          "_accuracy": match_rule.accuracy.value,
+                                          "category": match_rule.category})
+            elif match_rule.category and result.category != match_rule.category:
+                result.category = match_rule.category
+        if mappings:
+            session.bulk_insert_mappings(MatchRule, list(mappings.values()))
+
@@ -24,11 +24,13 @@ __version__ = 0.1
 
 import os
 import re
+import sys
 import enum
 import magic
 import hashlib
 import logging
 import hexdump
+import functools
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import Boolean
@@ -47,10 +49,29 @@ from datetime import datetime
 from termcolor import colored
 from typing import List
 
+try:
+    from re import _parser as regex_parser
+except ImportError:
+    import sre_parse as regex_parser
+
 DeclarativeBase = declarative_base()
 
 logger = logging.getLogger('model')
 
+# number of bytes that are read and hashed at once by File.read_file
+FILE_READ_SIZE = 1024 * 1024
+# number of leading bytes that libmagic inspects at most (default of MAGIC_PARAM_BYTES_MAX)
+MAGIC_BUFFER_SIZE = 7 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def compile_search_pattern(pattern):
+    """
+    This method compiles the given search pattern (str or bytes) case-insensitively. Match rule objects with the same
+    search pattern (e.g., the configured rules and the rules loaded from the database) share the compiled pattern.
+    """
+    return re.compile(pattern, re.IGNORECASE)
+
 
 class WorkspaceNotFound(Exception):
     def __init__(self, workspace: str):
@@ -112,6 +133,9 @@ class Workspace(DeclarativeBase):
                          backref=backref("workspace"),
                          cascade="all",
                          order_by="desc(File.size_bytes)")
+    archives = relationship("Archive",
+                            backref=backref("workspace"),
+                            cascade="all")
     creation_date = Column(DateTime, nullable=False, default=datetime.utcnow())
     last_modified = Column(DateTime, nullable=True, onupdate=datetime.utcnow())
 
@@ -191,9 +215,8 @@ class Path(DeclarativeBase):
 
     @full_path.setter
     def full_path(self, value: str) -> None:
-        self.extension = os.path.splitext(value)[1]
-        if self.extension:
-            self.extension = self.extension.lstrip(".")
+        # the few distinct extensions are interned as they are shared by many path objects
+        self.extension = sys.intern(os.path.splitext(value)[1].lstrip("."))
         self._full_path = value.replace("\\", "/")
         self.file_name = os.path.basename(self._full_path)
 
@@ -234,11 +257,49 @@ class File(DeclarativeBase):
 
     @content.setter
     def content(self, value: bytes):
+        self.set_content(value)
+
+    def set_content(self, value: bytes, sha256_value: str = None) -> None:
+        """
+        This method sets the file's content and computes its metadata.
+        :param value: The file's content as bytes or bytearray. A bytearray is kept as is to avoid copying large files.
+        :param sha256_value: The content's already computed SHA256 value. If None, then it is computed.
+        """
         self._content = value
         self.size_bytes = len(value)
-        self.sha256_value = self.calculate_sha256_value(value)
-        self.file_type = magic.from_buffer(value)
-        self.mime_type = magic.from_buffer(value, mime=True)
+        self.sha256_value = sha256_value if sha256_value else self.calculate_sha256_value(value)
+        # libmagic only accepts bytes and does not look beyond its maximum buffer size anyway
+        header = value if isinstance(value, bytes) else bytes(value[:MAGIC_BUFFER_SIZE])
+        self.file_type = magic.from_buffer(header)
+        self.mime_type = magic.from_buffer(header, mime=True)
+
+    @staticmethod
+    def read_file(file_name: str) -> "File":
+        """
+        This method reads the given file in chunks and computes the SHA256 value of each chunk right after it was read.
+        :param file_name: The file that shall be read
+        :return: File object containing the file's content
+        """
+        sha256 = hashlib.sha256()
+        with open(file_name, "rb") as file:
+            content = bytearray(os.fstat(file.fileno()).st_size)
+            offset = 0
+            with memoryview(content) as view:
+                while offset < len(content):
+                    count = file.readinto(view[offset:offset + FILE_READ_SIZE])
+                    if not count:
+                        break
+                    sha256.update(view[offset:offset + count])
+                    offset += count
+            # the file might have changed its size since we called stat
+            del content[offset:]
+            remainder = file.read()
+            if remainder:
+                sha256.update(remainder)
+                content.extend(remainder)
+        result = File()
+        result.set_content(content, sha256.hexdigest())
+        return result
 
     @property
     def review_result_str(self) -> str:
@@ -335,6 +396,38 @@ class File(DeclarativeBase):
         return result
 
 
+class Archive(DeclarativeBase):
+    """This class holds all information about already extracted archives."""
+
+    __tablename__ = "archive"
+    id = Column(Integer, primary_key=True)
+    sha256_value = Column(Text, nullable=False, unique=False)
+    workspace_id = Column(Integer, ForeignKey("workspace.id", ondelete='cascade'), nullable=False, unique=False)
+    creation_date = Column(DateTime, nullable=False, default=datetime.utcnow())
+    last_modified = Column(DateTime, nullable=True, onupdate=datetime.utcnow())
+    members = relationship("ArchiveMember",
+                           backref=backref("archive"),
+                           cascade="all, delete-orphan",
+                           order_by="asc(ArchiveMember.id)")
+    __table_args__ = (UniqueConstraint('sha256_value', 'workspace_id', name='_archive_unique'),)
+
+
+class ArchiveMember(DeclarativeBase):
+    """This class holds all information about the relevant members of an already extracted archive."""
+
+    __tablename__ = "archive_member"
+    id = Column(Integer, primary_key=True)
+    relative_path = Column(Text, nullable=False, unique=False)
+    share = Column(Text, nullable=True, unique=False)
+    access_time = Column(DateTime, nullable=True)
+    modified_time = Column(DateTime, nullable=True)
+    creation_time = Column(DateTime, nullable=True)
+    archive_id = Column(Integer, ForeignKey("archive.id", ondelete='cascade'), nullable=False, unique=False)
+    file_id = Column(Integer, ForeignKey("file.id", ondelete='cascade'), nullable=False, unique=False)
+    creation_date = Column(DateTime, nullable=False, default=datetime.utcnow())
+    last_modified = Column(DateTime, nullable=True, onupdate=datetime.utcnow())
+
+
 class MatchRule(DeclarativeBase):
     """This class holds all files"""
 
@@ -348,6 +441,8 @@ class MatchRule(DeclarativeBase):
     creation_date = Column(DateTime, nullable=False, default=datetime.utcnow())
     last_modified = Column(DateTime, nullable=True, onupdate=datetime.utcnow())
     _search_pattern_re = None
+    _search_pattern_re_text = None
+    _required_literal = None
     action = None
     __table_args__ = (UniqueConstraint('search_location', 'search_pattern', name='_match_rule_unique'),)
 
@@ -366,7 +461,9 @@ class MatchRule(DeclarativeBase):
     @search_pattern.setter
     def search_pattern(self, value: str) -> None:
         self._search_pattern = value
-        self._search_pattern_re = re.compile(value.encode("utf-8"), re.IGNORECASE)
+        self._search_pattern_re = compile_search_pattern(value.encode("utf-8"))
+        self._search_pattern_re_text = None
+        self._required_literal = None
 
     @property
     def search_location(self):
@@ -407,14 +504,14 @@ class MatchRule(DeclarativeBase):
     @property
     def search_pattern_re(self):
         if self._search_pattern_re is None:
-            self._search_pattern_re = re.compile(self._search_pattern.encode("utf-8"), re.IGNORECASE)
+            self._search_pattern_re = compile_search_pattern(self._search_pattern.encode("utf-8"))
         return self._search_pattern_re
 
     @property
     def search_pattern_re_text(self):
-        if self._search_pattern_re is None:
-            self._search_pattern_re = re.compile(self._search_pattern, re.IGNORECASE)
-        return self._search_pattern_re
+        if self._search_pattern_re_text is None:
+            self._search_pattern_re_text = compile_search_pattern(self._search_pattern)
+        return self._search_pattern_re_text
 
     @property
     def relevance_str(self):
@@ -445,17 +542,54 @@ class MatchRule(DeclarativeBase):
     def __eq__(self, value):
         return self.search_location == value.search_location and self.search_pattern == value.search_pattern
 
+    @property
+    def required_literal(self) -> bytes:
+        """
+        Returns the longest lower case byte sequence that every match of the search pattern must contain or an empty
+        byte string, if the search pattern does not contain such a sequence.
+        """
+        if self._required_literal is None:
+            result = b""
+            try:
+                run = bytearray()
+                for op, value in list(regex_parser.parse(self._search_pattern.encode("utf-8"))) + [(None, None)]:
+                    if op == regex_parser.LITERAL:
+                        run.append(value)
+                    else:
+                        if len(run) > len(result):
+                            result = bytes(run)
+                        run = bytearray()
+            except Exception:
+                result = b""
+            self._required_literal = result.lower()
+        return self._required_literal
+
+    def is_content_match(self, content: bytes, lower_content: bytes) -> bool:
+        """
+        This method determines whether the given file content matches this match rule. The regular expression is only
+        executed, if the content contains the search pattern's required literal.
+        :param content: The file content that is analyzed.
+        :param lower_content: The lower case version of the file content.
+        :return:
+        """
+        literal = self.required_literal
+        if literal and literal not in lower_content:
+            return False
+        return self.search_pattern_re.search(content) is not None
+
     def is_match(self, path: Path) -> bool:
         """
         This method determines whether the given path object matches this match rule.
         :param path: The path object that is analyzed.
         :return:
         """
-        if self.search_location == SearchLocation.file_content:
-            result = len(self.search_pattern_re.findall(path.file.content)) > 0
-        elif self.search_location == SearchLocation.file_name:
+        # compare the raw column value to avoid creating an enum object for every file and rule
+        if self._search_location == SearchLocation.file_content.value:
+            # the literal prefilter is not applied as it would require a lower case copy of the content per rule
+            result = self.search_pattern_re.search(path.file.content) is not None
+        elif self._search_location == SearchLocation.file_name.value:
             result = self.search_pattern_re.match(path.file_name.encode("utf-8")) is not None
-        elif self.search_location == SearchLocation.full_path:
+        elif self._search_location == SearchLocation.full_path.value:
             result = self.search_pattern_re.match(path.full_path.encode("utf-8")) is not None
         else:
             raise NotImplementedError("this case is not implemented")
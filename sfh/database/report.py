@@ -154,11 +154,11 @@ class _ReportGenerator(_BaseReportGenerator):
 class ReportGenerator:
     """This class creates all reports"""
 
-    def __init__(self, args):
+    def __init__(self, args, engine: Engine = None):
         self._generators = {ExcelReport.file.name: _ReportGenerator}
         self._args = args
         self._workspaces = args.workspace
-        self._engine = Engine()
+        self._engine = engine if engine else Engine()
 
     def run(self) -> None:
         """
@@ -42,6 +42,9 @@ from sqlalchemy import asc
 from sqlalchemy import desc
 from sqlalchemy.sql.expression import func
 
+RELEVANCE_NAMES = {item.value: item.name for item in FileRelevance}
+ACCURACY_NAMES = {item.value: item.name for item in MatchRuleAccuracy}
+
 
 class DistributionType(enum.Enum):
     relevance = enum.auto()
@@ -76,20 +79,40 @@ class ConsoleOption(enum.Enum):
 class ReviewConsole(Cmd):
     prompt = 'sfh> '
 
-    def __init__(self, args: argparse.Namespace):
+    def __init__(self, args: argparse.Namespace, engine: Engine = None):
         super().__init__()
         self._args = args
         self._cursor_id = 0
         self._options = {item: None for item in ConsoleOption}
         self._environment = None
-        self._engine = Engine()
+        self._engine = engine if engine else Engine()
         self._file_ids = []
+        self._total_count = 0
+        self._content_rules = []
+        self._compiled_filter = None
         self._config = FileHunterConfig()
+        # query builder, pivot index, and pivot columns per statistic
+        self._stats_specs = {DistributionType.result: (self._query_result_stats, None, None),
+                             DistributionType.relevance: (self._query_relevance_stats, "relevance", "accuracy"),
+                             DistributionType.extension: (self._query_extension_stats,
+                                                          "extension",
+                                                          ["relevance", "accuracy"]),
+                             DistributionType.mimetype: (self._query_mimetype_stats,
+                                                         "mime_type",
+                                                         ["relevance", "accuracy"])}
         if args.workspace:
             self._options[ConsoleOption.workspace] = args.workspace
         self._options[ConsoleOption.filter] = "File.review_result IS NULL OR File.review_result = 'tbd'"
+        self._compile_filter()
         self._update_file_list()
 
+    def _compile_filter(self):
+        """
+        This method compiles the current filter option into a SQL clause, which is then reused by all queries until
+        the filter option changes again.
+        """
+        self._compiled_filter = text("({})".format(self._options[ConsoleOption.filter]))
+
     def _update_prompt_text(self):
         """
         This method returns the current command prompt.
@@ -98,7 +121,7 @@ class ReviewConsole(Cmd):
         if self._options[ConsoleOption.workspace]:
             result += " ({})".format(self._options[ConsoleOption.workspace])
         if self._cursor_id:
-            result += " [{}/{}]".format(self._cursor_id, len(self._file_ids))
+            result += " [{}/{}]".format(self._cursor_id, self._total_count)
         result += "> "
         self.prompt = result
 
@@ -111,14 +134,20 @@ class ReviewConsole(Cmd):
                 .join(Workspace)
                 .join((MatchRule, File.matches))
                 .join((Path, File.paths))
-                .filter(text("Workspace.name = '{}' and {}".format(self._options[ConsoleOption.workspace],
-                                                                   self._options[ConsoleOption.filter])))
+                .filter(Workspace.name == self._options[ConsoleOption.workspace], self._compiled_filter)
                 .distinct()
                 .order_by(desc(MatchRule._search_location),
                           desc(MatchRule._relevance),
                           desc(MatchRule._accuracy),
                           func.length(MatchRule._search_pattern).desc(),
                           asc(Path.extension))]
+            # the file content rules are used to highlight matches and do not change while reviewing. therefore, we
+            # load them together with the file list and detach them from the session so that they can be reused
+            self._content_rules = session.query(MatchRule) \
+                .filter_by(_search_location=SearchLocation.file_content.value).all()
+            for rule in self._content_rules:
+                session.expunge(rule)
+        self._total_count = len(self._file_ids)
         self._cursor_id = 0
         self._update_prompt_text()
         self.do_n(None)
@@ -127,14 +156,13 @@ class ReviewConsole(Cmd):
         """
         This method displays the currently selected file
         """
-        if 0 < self._cursor_id <= len(self._file_ids):
+        if 0 < self._cursor_id <= self._total_count:
             id = self._file_ids[self._cursor_id - 1]
             with self._engine.session_scope() as session:
                 file = session.query(File).filter_by(id=id).one_or_none()
-                rules = session.query(MatchRule).filter_by(_search_location=SearchLocation.file_content.value).all()
                 if file:
                     result = file.get_text(color=not self._args.nocolor,
-                                           match_rules=rules,
+                                           match_rules=self._content_rules,
                                            threshold=self._config.threshold)
                     self._update_prompt_text()
             if sys.platform == "windows":
@@ -148,7 +176,7 @@ class ReviewConsole(Cmd):
         Display the next file
         """
         if self._options[ConsoleOption.workspace]:
-            if (self._cursor_id + 1) <= len(self._file_ids):
+            if (self._cursor_id + 1) <= self._total_count:
                 self._cursor_id += 1
                 self._update_view()
             else:
@@ -267,21 +295,26 @@ class ReviewConsole(Cmd):
             print(ConsoleOption.get_text(tmp))
             return
         previous_value = self._options[option]
-        value = " ".join(arguments[1:])
+        # surrounding whitespace (e.g., several spaces after the option's name) is not part of the value
+        value = " ".join(arguments[1:]).strip()
         # input validation
         if option == ConsoleOption.workspace:
             with self._engine.session_scope() as session:
                 if session.query(Workspace).filter_by(name=value).count() == 0:
                     print("workspace '{}' does not exist.".format(value))
                     return
+        # Nothing to do, if the value did not change. use command refresh to reload the current results
+        if previous_value == value:
+            return
         self._options[option] = value
         if option == ConsoleOption.filter:
-            self._options[option] = value
+            self._compile_filter()
             try:
                 self._update_file_list()
             except Exception as ex:
                 print(ex)
                 self._options[option] = previous_value
+                self._compile_filter()
                 return
         elif option == ConsoleOption.workspace:
             self._update_file_list()
@@ -292,87 +325,61 @@ class ReviewConsole(Cmd):
 set the given option to value.  If value is omitted, print the current value.
 If both are omitted, print options that are currently set.""")
 
+    def _query_result_stats(self, session):
+        return session.query(File.review_result, func.count(File.id)) \
+            .group_by(File.review_result) \
+            .order_by(File.review_result)
+
+    def _query_relevance_stats(self, session):
+        return session.query(MatchRule._relevance, MatchRule._accuracy, func.count(File.id)) \
+            .join((File, MatchRule.files)) \
+            .join((Workspace, File.workspace)) \
+            .filter(Workspace.name == self._options[ConsoleOption.workspace], self._compiled_filter) \
+            .group_by(MatchRule._relevance, MatchRule._accuracy) \
+            .order_by(MatchRule._relevance, MatchRule._accuracy)
+
+    def _query_extension_stats(self, session):
+        return session.query(Path.extension, MatchRule._relevance, MatchRule._accuracy, func.count(File.id)) \
+            .join((File, Path.file)) \
+            .join((MatchRule, File.matches)) \
+            .join((Workspace, File.workspace)) \
+            .filter(Workspace.name == self._options[ConsoleOption.workspace], self._compiled_filter) \
+            .group_by(Path.extension, MatchRule._relevance, MatchRule._accuracy) \
+            .order_by(MatchRule._relevance, MatchRule._accuracy)
+
+    def _query_mimetype_stats(self, session):
+        return session.query(File.mime_type, MatchRule._relevance, MatchRule._accuracy, func.count(File.id)) \
+            .join((MatchRule, File.matches)) \
+            .join((Workspace, File.workspace)) \
+            .filter(Workspace.name == self._options[ConsoleOption.workspace], self._compiled_filter) \
+            .group_by(File.mime_type, MatchRule._relevance, MatchRule._accuracy) \
+            .order_by(MatchRule._relevance, MatchRule._accuracy)
+
     def do_stats(self, input: str):
         arguments = input.strip().split(" ")
         if len(arguments) == 1 and arguments[0] and arguments[0] in [item.name for item in DistributionType]:
-            argument = DistributionType[arguments[0]]
-            if argument == DistributionType.result:
-                try:
-                    with self._engine.session_scope() as session:
-                        q = session.query(File.review_result, func.count(File.id)) \
-                            .group_by(File.review_result) \
-                            .order_by(File.review_result)
-                        df = pandas.read_sql(q.statement, q.session.bind)
-                        df["review_result"] = df["review_result"].apply(lambda x: x.name if x else x)
-                        print(df)
-                except Exception as ex:
-                    print(ex)
-            elif argument == DistributionType.relevance:
-                try:
-                    with self._engine.session_scope() as session:
-                        q = session.query(MatchRule._relevance, MatchRule._accuracy, func.count(File.id)) \
-                            .join((File, MatchRule.files)) \
-                            .join((Workspace, File.workspace)) \
-                            .filter(text("Workspace.name = '{}' and {}".format(self._options[ConsoleOption.workspace],
-                                                                               self._options[ConsoleOption.filter]))) \
-                            .group_by(MatchRule._relevance, MatchRule._accuracy) \
-                            .order_by(MatchRule._relevance, MatchRule._accuracy)
-                        df = pandas.read_sql(q.statement, q.session.bind)
-                        df["relevance"] = df["relevance"].apply(lambda x: FileRelevance(x).name)
-                        df["accuracy"] = df["accuracy"].apply(lambda x: MatchRuleAccuracy(x).name)
-                        print(pandas.pivot_table(df,
-                                                 index="relevance",
-                                                 columns="accuracy",
-                                                 values="count_1",
-                                                 aggfunc=numpy.sum,
-                                                 fill_value=0))
-                except Exception as ex:
-                    print(ex)
-            elif argument == DistributionType.extension:
-                try:
-                    with self._engine.session_scope() as session:
-                        q = session.query(Path.extension, MatchRule._relevance, MatchRule._accuracy, func.count(File.id)) \
-                            .join((File, Path.file)) \
-                            .join((MatchRule, File.matches)) \
-                            .join((Workspace, File.workspace)) \
-                            .filter(text("Workspace.name = '{}' and {}".format(self._options[ConsoleOption.workspace],
-                                                                               self._options[ConsoleOption.filter]))) \
-                            .group_by(Path.extension, MatchRule._relevance, MatchRule._accuracy) \
-                            .order_by(MatchRule._relevance, MatchRule._accuracy)
-                        df = pandas.read_sql(q.statement, q.session.bind)
-                        df["relevance"] = df["relevance"].apply(lambda x: FileRelevance(x).name)
-                        df["accuracy"] = df["accuracy"].apply(lambda x: MatchRuleAccuracy(x).name)
-                        print(pandas.pivot_table(df,
-                                                 index="extension",
-                                                 columns=["relevance", "accuracy"],
-                                                 values="count_1",
-                                                 aggfunc=numpy.sum,
-                                                 fill_value=0))
-                except Exception as ex:
-                    print(ex)
-            elif argument == DistributionType.mimetype:
-                try:
-                    with self._engine.session_scope() as session:
-                        q = session.query(File.mime_type, MatchRule._relevance, MatchRule._accuracy, func.count(File.id)) \
-                            .join((MatchRule, File.matches)) \
-                            .join((Workspace, File.workspace)) \
-                            .filter(text("Workspace.name = '{}' and {}".format(self._options[ConsoleOption.workspace],
-                                                                               self._options[ConsoleOption.filter]))) \
-                            .group_by(File.mime_type, MatchRule._relevance, MatchRule._accuracy) \
-                            .order_by(MatchRule._relevance, MatchRule._accuracy)
-                        df = pandas.read_sql(q.statement, q.session.bind)
-                        df["relevance"] = df["relevance"].apply(lambda x: FileRelevance(x).name)
-                        df["accuracy"] = df["accuracy"].apply(lambda x: MatchRuleAccuracy(x).name)
-                        print(pandas.pivot_table(df,
-                                                 index="mime_type",
-                                                 columns=["relevance", "accuracy"],
-                                                 values="count_1",
-                                                 aggfunc=numpy.sum,
-                                                 fill_value=0))
-                except Exception as ex:
-                    print(ex)
-            else:
-                raise NotImplementedError("case not implemented")
+            query_stats, index, columns = self._stats_specs[DistributionType[arguments[0]]]
+            try:
+                with self._engine.session_scope() as session:
+                    q = query_stats(session)
+                    df = pandas.read_sql(q.statement, q.session.bind)
+                if "review_result" in df:
+                    df["review_result"] = df["review_result"].apply(lambda x: x.name if x else x)
+                if "relevance" in df:
+                    df["relevance"] = df["relevance"].map(RELEVANCE_NAMES)
+                if "accuracy" in df:
+                    df["accuracy"] = df["accuracy"].map(ACCURACY_NAMES)
+                if index:
+                    print(pandas.pivot_table(df,
+                                             index=index,
+                                             columns=columns,
+                                             values="count_1",
+                                             aggfunc=numpy.sum,
+                                             fill_value=0))
+                else:
+                    print(df)
+            except Exception as ex:
+                print(ex)
         else:
             self.help_stats()
 
@@ -21,13 +21,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 __version__ = 0.1
 
 import os
-import time
+import select
 import enum
 import passgen
 import argparse
 import subprocess
 import logging
-from threading import Thread
 from database.core import Engine
 from database.model import Workspace
 from config.config import DatabaseType
@@ -39,6 +38,9 @@ Session = sessionmaker()
 
 logger = logging.getLogger('setup')
 
+# number of bytes that are read at once from the pipes of setup commands
+READ_SIZE = 65536
+
 
 class SetupTask(enum.Enum):
     create_link_file = enum.auto()
@@ -53,11 +55,36 @@ class SetupCommand:
         self._return_code = return_code
         self._command = command
 
-    def _print_output(self, prefix: str, output: list) -> None:
-        for line in iter(output.readline, b''):
+    @staticmethod
+    def _print_output(prefix: str, data: bytes) -> None:
+        for line in data.split(b"\n"):
             line = line.decode("utf-8").strip()
             print("{}   {}".format(prefix, line))
 
+    def _read_output(self, p: subprocess.Popen) -> None:
+        """
+        This method prints the output of the given process' stdout and stderr pipes until both are closed.
+        """
+        prefixes = {p.stdout.fileno(): "[*]", p.stderr.fileno(): "[e]"}
+        buffers = {fd: bytearray() for fd in prefixes}
+        for fd in prefixes:
+            os.set_blocking(fd, False)
+        while buffers:
+            readable, _, _ = select.select(list(buffers.keys()), [], [], 1)
+            for fd in readable:
+                data = os.read(fd, READ_SIZE)
+                buffer = buffers[fd]
+                if data:
+                    buffer.extend(data)
+                    index = buffer.rfind(b"\n")
+                    if index >= 0:
+                        self._print_output(prefixes[fd], bytes(buffer[:index]))
+                        del buffer[:index + 1]
+                else:
+                    if buffer:
+                        self._print_output(prefixes[fd], bytes(buffer))
+                    del buffers[fd]
+
     def execute(self, debug: bool=False) -> bool:
         "Executes the given command"
         rvalue = True
@@ -65,11 +92,9 @@ class SetupCommand:
         print("    $ {}".format(subprocess.list2cmdline(self._command)))
         if not debug:
             p = subprocess.Popen(self._command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            Thread(target=self._print_output, args=("[*]", p.stdout, ), daemon=True).start()
-            Thread(target=self._print_output, args=("[e]", p.stderr, ), daemon=True).start()
+            self._read_output(p)
             return_code = p.wait()
             rvalue = (self._return_code == return_code if self._return_code is not None else True)
-            time.sleep(1)
         return rvalue
 
 
@@ -85,20 +110,16 @@ class ManageDatabase:
 
     def run(self):
         if self._arguments.module == "db":
+            engine = Engine()
             if self._arguments.backup:
-                engine = Engine()
                 engine.create_backup(self._arguments.backup)
             if self._arguments.restore:
-                engine = Engine()
                 engine.restore_backup(self._arguments.restore)
             if self._arguments.drop:
-                engine = Engine()
                 engine.recreate_database()
             if self._arguments.init:
-                engine = Engine()
                 engine.init()
             if self._arguments.add:
-                engine = Engine()
                 with engine.session_scope() as session:
                     workspace = Workspace(name=self._arguments.add)
                     session.add(workspace)
@@ -24,33 +24,64 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 __version__ = 0.1
 
 import sys
-import ftplib
 import logging
 import argparse
 import tempfile
-import impacket
-from queue import Queue
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from database.core import Engine
 from database.core import DeclarativeBase
 from database.setup import SetupTask
 from database.setup import ManageDatabase
-from database.review import ReviewConsole
-from database.report import ReportGenerator
 from database.model import WorkspaceNotFound
 from database.model import HunterType
-from database.model import Host
-from database.model import Service
-from database.model import Workspace
 from config.config import DatabaseType
+from hunters.core import QUEUE_BATCH_SIZE
+from hunters.core import QUEUE_MAX_BYTES
+from hunters.core import BatchedFileQueue
+from hunters.core import DatabaseWriter
+from hunters.core import init_content_worker
 from hunters.analyzer.core import FileAnalzer
-from hunters.modules.smb import SmbSensitiveFileHunter
-from hunters.modules.ftp import FtpSensitiveFileHunter
-from hunters.modules.nfs import NfsSensitiveFileHunter
-from hunters.modules.local import LocalSensitiveFileHunter
 from config.config import FileHunter as FileHunterConfig
 
 logger = logging.getLogger("main")
 
+# hunter modules are only imported, if they are selected on the command line as importing their dependencies (e.g.,
+# impacket or libnfs) is expensive
+HUNTER_MODULES = {HunterType.smb.name: ("hunters.modules.smb",
+                                        "SmbSensitiveFileHunter",
+                                        "enumerate SMB services"),
+                  HunterType.ftp.name: ("hunters.modules.ftp",
+                                        "FtpSensitiveFileHunter",
+                                        "enumerate FTP services. note that the FTP service must support the MLSD "
+                                        "command"),
+                  HunterType.nfs.name: ("hunters.modules.nfs",
+                                        "NfsSensitiveFileHunter",
+                                        "enumerate NFS services"),
+                  HunterType.local.name: ("hunters.modules.local",
+                                          "LocalSensitiveFileHunter",
+                                          "enumerate local file system")}
+
+# exceptions (module name: (class name, log message)) that indicate a failed login to the enumerated service
+LOGIN_ERRORS = {"ftplib": ("error_perm", "FTP login failed"),
+                "impacket.smbconnection": ("SessionError", "SMB login failed")}
+
+
+def get_hunter_module(argv: list) -> str:
+    """
+    This method returns the name of the hunter module that is selected by the given command line arguments.
+    """
+    skip = False
+    for item in argv:
+        if skip:
+            skip = False
+        elif item == "--log":
+            skip = True
+        elif not item.startswith("-"):
+            return item if item in HUNTER_MODULES else None
+    return None
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
@@ -106,25 +137,17 @@ if __name__ == "__main__":
     parser_report.add_argument('-e', '--excel', type=str, help="write report to given excel file")
     parser_report.add_argument('-c', '--csv', action="store_true", help="print report results to stdout as CSV")
 
-    # setup SMB parser
-    parser_smb = sub_parser.add_parser(HunterType.smb.name, help='enumerate SMB services')
-    SmbSensitiveFileHunter.add_argparse_arguments(parser_smb)
-
-    # setup FTP parser
-    parser_ftp = sub_parser.add_parser(HunterType.ftp.name,
-                                       help='enumerate FTP services. note that the FTP service must support the MLSD '
-                                            'command')
-    FtpSensitiveFileHunter.add_argparse_arguments(parser_ftp)
-
-    # setup NFS parser
-    parser_nfs = sub_parser.add_parser(HunterType.nfs.name, help='enumerate NFS services')
-    NfsSensitiveFileHunter.add_argparse_arguments(parser_nfs)
-
-    # setup local parser
-    parser_local = sub_parser.add_parser(HunterType.local.name, help='enumerate local file system')
-    LocalSensitiveFileHunter.add_argparse_arguments(parser_local)
+    # setup hunter parsers
+    enumeration_class = None
+    hunter_parsers = {name: sub_parser.add_parser(name, help=description)
+                      for name, (_, _, description) in HUNTER_MODULES.items()}
+    hunter_module = get_hunter_module(sys.argv[1:])
+    if hunter_module:
+        module_name, class_name, _ = HUNTER_MODULES[hunter_module]
+        enumeration_class = getattr(importlib.import_module(module_name), class_name)
+        enumeration_class.add_argparse_arguments(hunter_parsers[hunter_module])
     args = parser.parse_args()
-    
+
     level = logging.DEBUG if args.debug else logging.INFO
     handlers = [logging.StreamHandler()]
     if args.log:
@@ -140,73 +163,83 @@ if __name__ == "__main__":
 
     try:
         with tempfile.TemporaryDirectory() as temp_dir:
-            enumeration_class = None
-            if args.list:
+            if args.list or args.module not in ["db", "setup"]:
                 engine = Engine()
                 DeclarativeBase.metadata.bind = engine.engine
+            if args.list:
                 engine.print_workspaces()
             elif args.module in ["db", "setup"]:
                 ManageDatabase(args).run()
             elif args.module == "review":
+                # pandas and openpyxl are only imported by the modules that use them as importing them is expensive
+                from database.review import ReviewConsole
                 if args.workspace:
-                    engine = Engine()
                     with engine.session_scope() as session:
                         engine.get_workspace(session=session, name=args.workspace, ignore=args.ignore)
-                ReviewConsole(args=args).cmdloop()
+                ReviewConsole(args=args, engine=engine).cmdloop()
             elif args.module == "report":
+                from database.report import ReportGenerator
                 if args.workspace:
-                    engine = Engine()
                     with engine.session_scope() as session:
-                        for workspace in args.workspace:
-                            engine.get_workspace(session=session, name=workspace, ignore=args.ignore)
-                ReportGenerator(args=args).run()
-            elif args.module == HunterType.smb.name:
-                enumeration_class = SmbSensitiveFileHunter
-            elif args.module == HunterType.ftp.name:
-                enumeration_class = FtpSensitiveFileHunter
-            elif args.module == HunterType.nfs.name:
-                enumeration_class = NfsSensitiveFileHunter
-            elif args.module == HunterType.local.name:
-                enumeration_class = LocalSensitiveFileHunter
-            if enumeration_class:
+                        engine.get_workspaces(session=session, names=args.workspace, ignore=args.ignore)
+                ReportGenerator(args=args, engine=engine).run()
+            elif enumeration_class:
+                # the archive tables were added later and are therefore missing in databases of earlier versions
+                engine.create_archive_tables()
                 analyzers = []
-                engine = Engine()
                 config = FileHunterConfig(domain_names=args.domains)
-                file_queue = Queue(maxsize=20)
-                DeclarativeBase.metadata.bind = engine.engine
+                file_queue = BatchedFileQueue(maxsize=QUEUE_BATCH_SIZE * args.threads, maxbytes=QUEUE_MAX_BYTES)
+                executor = None
+                if args.threads_mode == "process":
+                    # processes are spawned as forking a process with running analysis threads is unsafe
+                    executor = ProcessPoolExecutor(max_workers=args.threads,
+                                                   mp_context=multiprocessing.get_context("spawn"),
+                                                   initializer=init_content_worker,
+                                                   initargs=(args.domains, ))
                 # Check wheather name space exists
                 with engine.session_scope() as session:
                     workspace = engine.get_workspace(session=session, name=args.workspace, ignore=args.ignore)
+                # Create the thread that writes all analysis results into the database
+                db_writer = DatabaseWriter(engine=engine, workspace=args.workspace)
+                db_writer.start()
                 # Create analysis/consumer threads
                 for i in range(args.threads):
-                    analyzer = FileAnalzer(args=args, engine=engine, file_queue=file_queue, config=config)
+                    analyzer = FileAnalzer(args=args,
+                                           engine=engine,
+                                           file_queue=file_queue,
+                                           executor=executor,
+                                           db_writer=db_writer,
+                                           config=config)
                     analyzers.append(analyzer)
                     analyzer.start()
-                hunter = enumeration_class(args, engine=engine, file_queue=file_queue, config=config, temp_dir=temp_dir)
+                hunter = enumeration_class(args,
+                                           engine=engine,
+                                           file_queue=file_queue,
+                                           db_writer=db_writer,
+                                           config=config,
+                                           temp_dir=temp_dir)
                 hunter.enumerate()
                 if args.verbose:
                     logger.info("consumer thread finished enumeration. current queue "
                                 "size: {:>2d}".format(file_queue.qsize()))
                 file_queue.join()
+                if executor:
+                    executor.shutdown(wait=True)
+                db_writer.stop()
+                hunter.set_complete()
                 if args.verbose:
                     # print statistics
                     for item in analyzers:
                         logger.info("completed consumer " + str(item))
-                    with engine.session_scope() as session:
-                        service = session.query(Service) \
-                            .join(Host) \
-                            .join(Workspace) \
-                            .filter(Workspace.name == args.workspace,
-                                    Host.address == hunter.address,
-                                    Service.port == hunter.port).one()
-                        service.complete = True
     except WorkspaceNotFound as ex:
         pass
-    except ftplib.error_perm:
-        logger.error("FTP login failed", exc_info=args.verbose)
-    except impacket.smbconnection.SessionError:
-        logger.error("SMB login failed", exc_info=args.verbose)
     except NotADirectoryError:
         logger.error("Given item is not a directory", exc_info=args.verbose)
     except Exception as ex:
-        logger.error("execution failed", exc_info=args.verbose)
+        message = "execution failed"
+        # the hunter modules' client libraries are only loaded, if the respective hunter module was selected
+        for module_name, (class_name, login_message) in LOGIN_ERRORS.items():
+            module = sys.modules.get(module_name)
+            if module and isinstance(ex, getattr(module, class_name)):
+                message = login_message
+        logger.error(message, exc_info=args.verbose)
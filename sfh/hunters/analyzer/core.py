@@ -22,43 +22,62 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 __version__ = 0.1
 
+import io
 import os
-import glob
 import logging
+import tarfile
 import tempfile
+import zipfile
+import itertools
 from datetime import datetime
 from datetime import timezone
+from threading import Lock
+from collections import OrderedDict
 from pyunpack import Archive
 from hunters.core import BaseAnalyzer
+from hunters.core import QUEUE_BATCH_SIZE
+from hunters.core import scan_files
+from hunters.core import create_path
+from hunters.core import set_file
 from database.model import Path
 from database.model import File
+from database.model import MatchRule
 
 logger = logging.getLogger('analyzer')
 
+# number of archives whose analysis results are kept in memory to replay them for archives with the same content
+ARCHIVE_CACHE_SIZE = 1024
+
 
 class FileAnalzer(BaseAnalyzer):
     """
     This class is responsible for analysing a given file.
     """
-    ID = 0
+    # ids of the analysis threads (next() is atomic, whereas incrementing a class attribute is not)
+    ID_COUNTER = itertools.count(1)
+    # analysis results of already extracted archives (sha256 value: list of results)
+    ARCHIVE_RESULTS = OrderedDict()
+    ARCHIVE_RESULTS_LOCK = Lock()
 
     def __init__(self, **kwargs):
         super().__init__(daemon=True, **kwargs)
-        FileAnalzer.ID += 1
-        self._id = FileAnalzer.ID
+        self._id = next(FileAnalzer.ID_COUNTER)
+        # stack of (archive path, results) tuples of the archives that are currently extracted
+        self._archive_recordings = []
         self._number_of_processed_files = 0
         self._number_of_failed_files = 0
 
     def run(self):
         while True:
-            try:
-                path = self.file_queue.get()
-                self._number_of_processed_files += 1
-                self.analyze(path)
-            except Exception as ex:
-                logger.exception(ex)
-                self._number_of_failed_files += 1
-            self.file_queue.task_done()
+            paths = self.file_queue.get_many(QUEUE_BATCH_SIZE)
+            for path in paths:
+                try:
+                    self._number_of_processed_files += 1
+                    self.analyze(path)
+                except Exception as ex:
+                    logger.exception(ex)
+                    self._number_of_failed_files += 1
+            self.file_queue.task_done(len(paths))
 
     def __repr__(self):
         return "thread {:>3d}: " \
@@ -74,7 +93,7 @@ class FileAnalzer(BaseAnalyzer):
         :return:
         """
         with self.engine.session_scope() as session:
-            workspace = self.engine.get_workspace(session=session, name=self.workspace)
+            workspace = self._get_workspace(session)
             file = self.engine.get_file(session=session,
                                         workspace=workspace,
                                         sha256_value=path.file.sha256_value)
@@ -85,8 +104,10 @@ class FileAnalzer(BaseAnalyzer):
             success = False
             if self.config.is_archive(path):
                 try:
-                    self._extract_archive(path)
-                    success = True
+                    success = self._replay_archive(path)
+                    if not success:
+                        self._extract_archive(path)
+                        success = True
                 except Exception as ex:
                     logger.exception(ex)
             if not success:
@@ -100,30 +121,137 @@ class FileAnalzer(BaseAnalyzer):
                 if not result:
                     result = self._analyze_path_name(path)
                     if self._args.debug and not result:
-                        logger.debug("ignoring file (threshold: below, size: {}): {}".format(path.file.size_bytes,
-                                                                                             str(path)))
+                        logger.debug("ignoring file (threshold: below, size: %d): %s", path.file.size_bytes, path)
+
+    def _store_content(self, path: Path, rule: MatchRule = None, file_id: int = None):
+        """
+        This method additionally records the given result for all archives that are currently extracted.
+        """
+        for archive_path, results in self._archive_recordings:
+            results.append((path.full_path[len(archive_path):],
+                            path.share,
+                            path.access_time,
+                            path.modified_time,
+                            path.creation_time,
+                            rule,
+                            file_id,
+                            path.file.sha256_value if rule else None))
+        super()._store_content(path=path, rule=rule, file_id=file_id)
+
+    def _replay_archive(self, path: Path) -> bool:
+        """
+        This method adds the recorded results of an already extracted archive with the same content to the given
+        archive path so that the archive does not have to be extracted again. The results are either obtained from
+        memory or from an earlier run's archive members stored in the database.
+        :return: True if results for the given archive existed
+        """
+        with FileAnalzer.ARCHIVE_RESULTS_LOCK:
+            results = FileAnalzer.ARCHIVE_RESULTS.get(path.file.sha256_value)
+            if results is not None:
+                FileAnalzer.ARCHIVE_RESULTS.move_to_end(path.file.sha256_value)
+        with self.engine.session_scope() as session:
+            workspace = self._get_workspace(session)
+            if results is None:
+                archive = self.engine.get_archive(session=session,
+                                                  workspace=workspace,
+                                                  sha256_value=path.file.sha256_value)
+                if not archive:
+                    return False
+                results = [(item.relative_path,
+                            item.share,
+                            item.access_time,
+                            item.modified_time,
+                            item.creation_time,
+                            None,
+                            item.file_id,
+                            None) for item in archive.members]
+                self._cache_archive(path.file.sha256_value, results)
+            # the results only record the sha256 values of new member files, whose content is obtained from the database
+            file_ids = []
+            for _, _, _, _, _, _, file_id, sha256_value in results:
+                if file_id is None:
+                    file = self.engine.get_file(session=session, workspace=workspace, sha256_value=sha256_value)
+                    if not file:
+                        # the member file was not written yet, hence the archive must be extracted again
+                        return False
+                    file_id = file.id
+                file_ids.append(file_id)
+        logger.debug("replaying results of already extracted archive: %s", path)
+        for (suffix, share, access_time, modified_time, creation_time, _, _, _), file_id in zip(results, file_ids):
+            member = create_path(path.service,
+                                 full_path=path.full_path + suffix,
+                                 share=share,
+                                 access_time=access_time,
+                                 modified_time=modified_time,
+                                 creation_time=creation_time)
+            self._store_content(path=member, file_id=file_id)
+        return True
 
     def _extract_archive(self, path: Path):
         """
-        This method extracts and analyses the given archive file.
+        This method extracts and analyses the given archive file. The analysis results are recorded so that they can be
+        replayed for archives with the same content.
+        """
+        results = []
+        self._archive_recordings.append((path.full_path, results))
+        try:
+            self._extract_members(path)
+        finally:
+            self._archive_recordings.pop()
+        self._cache_archive(path.file.sha256_value, results)
+        self._store_archive(path.file.sha256_value, results)
+
+    @staticmethod
+    def _cache_archive(sha256_value: str, results: list) -> None:
+        """
+        This method keeps the given results of an extracted archive in memory.
+        """
+        with FileAnalzer.ARCHIVE_RESULTS_LOCK:
+            FileAnalzer.ARCHIVE_RESULTS[sha256_value] = results
+            if len(FileAnalzer.ARCHIVE_RESULTS) > ARCHIVE_CACHE_SIZE:
+                FileAnalzer.ARCHIVE_RESULTS.popitem(last=False)
+
+    @staticmethod
+    def extract_archive(content: bytes, directory: str) -> None:
+        """
+        This method extracts the given archive content into the given directory. ZIP and TAR files (including
+        compressed TAR files) are extracted in-process from memory. TAR files are only extracted in-process, if module
+        tarfile supports extraction filters. All other archives must be written to a temporary file for pyunpack, which
+        runs the respective extraction program via patool.
+        """
+        buffer = io.BytesIO(content)
+        is_zipfile = zipfile.is_zipfile(buffer)
+        buffer.seek(0)
+        if is_zipfile:
+            zipfile.ZipFile(buffer).extractall(directory)
+        elif hasattr(tarfile, "data_filter") and tarfile.is_tarfile(buffer):
+            # the data filter ensures that members are not extracted outside the given directory. without it, TAR files
+            # are extracted by tar via patool, which refuses such members as well
+            with tarfile.open(fileobj=buffer) as archive:
+                archive.extractall(directory, filter="data")
+        else:
+            with tempfile.NamedTemporaryFile() as file:
+                file.write(content)
+                file.flush()
+                Archive(file.name).extractall(directory)
+
+    def _extract_members(self, path: Path):
+        """
+        This method extracts the given archive file and analyses its members.
         """
-        with tempfile.NamedTemporaryFile() as file_name:
-            with open(file_name.name, "wb") as file:
-                file.write(path.file.content)
-            with tempfile.TemporaryDirectory() as dir_name:
-                Archive(file_name.name).extractall(dir_name)
-                for item in glob.glob(dir_name + "/**", recursive=True):
-                    stats = os.stat(item)
-                    if os.path.isfile(item):
-                        full_path = item.replace(dir_name, path.full_path, 1)
-                        with open(item, "rb") as file:
-                            content = file.read()
-                        tmp = Path(service=path.service,
-                                   full_path=full_path,
-                                   access_time=datetime.fromtimestamp(stats.st_atime, tz=timezone.utc),
-                                   modified_time=datetime.fromtimestamp(stats.st_mtime, tz=timezone.utc),
-                                   creation_time=datetime.fromtimestamp(stats.st_ctime, tz=timezone.utc),
-                                   file=File(content=content))
-                        self.analyze(tmp)
-                    elif os.path.isfile(item):
-                        logger.debug("skip file: {}".format(item))
\ No newline at end of file
+        with tempfile.TemporaryDirectory() as dir_name:
+            self.extract_archive(path.file.content, dir_name)
+            # members are obtained lazily and only read, if they are below the threshold
+            for entry in scan_files(dir_name):
+                stats = entry.stat(follow_symlinks=False)
+                full_path = entry.path.replace(dir_name, path.full_path, 1)
+                tmp = create_path(path.service,
+                                  full_path=full_path,
+                                  access_time=datetime.fromtimestamp(stats.st_atime, tz=timezone.utc),
+                                  modified_time=datetime.fromtimestamp(stats.st_mtime, tz=timezone.utc),
+                                  creation_time=datetime.fromtimestamp(stats.st_ctime, tz=timezone.utc))
+                if self.is_file_size_below_threshold(tmp, stats.st_size):
+                    set_file(tmp, File.read_file(entry.path))
+                    self.analyze(tmp)
+                elif stats.st_size > 0:
+                    self._analyze_path_above_threshold(tmp, stats.st_size)
@@ -22,41 +22,499 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 __version__ = 0.1
 
+import os
+import time
 import logging
 import argparse
 from queue import Queue
+from queue import Empty
+from collections import deque
+from collections import OrderedDict
 from threading import Lock
 from threading import Thread
+from threading import Condition
+from concurrent.futures import Executor
 from database.core import Engine
 from database.model import Path
+from database.model import Service
+from database.model import Workspace
 from database.model import File
 from database.model import MatchRule
+from database.model import ArchiveMember
 from database.model import SearchLocation
 from database.model import FileRelevance
 from config.config import FileHunter as FileHunterConfig
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 logger = logging.getLogger('analyzer')
 
+# number of path objects that producers and consumers add to or remove from the file queue at once
+QUEUE_BATCH_SIZE = 32
+
+# number of content bytes that the file queue holds at most (a larger single file is still accepted by an empty queue)
+QUEUE_MAX_BYTES = 256 * 1024 * 1024
+
+# number of analysis results that the database writer commits in one transaction
+DB_BATCH_SIZE = 200
+
+# number of seconds that the database writer waits for further analysis results before it commits a batch
+DB_BATCH_DELAY = 0.05
+
+# number of file contents whose matching file content rule is kept in memory (see BaseAnalyzer.CONTENT_RESULTS)
+CONTENT_CACHE_SIZE = 65536
+
+# content that is stored instead of the actual content of files above the threshold (arguments: path and file size)
+ABOVE_THRESHOLD_CONTENT = b"[file (%s) not imported as file size (%d) is above threshold]"
+
+# file content matcher of the current analysis process (see init_content_worker)
+_worker_content_matcher = None
+
+
+def scan_files(directory: str, excluded: set = None):
+    """
+    This method recursively yields the directory entries of all regular files below the given directory. Symbolic links
+    are not followed.
+    :param excluded: The names of the directories that are not descended into.
+    """
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        logger.error("cannot access directory: %s", directory)
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if excluded and entry.name in excluded:
+                    logger.debug("skip excluded directory: %s", entry.path)
+                else:
+                    yield from scan_files(entry.path, excluded)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+            else:
+                logger.debug("skip file: %s", entry.path)
+
+
+def create_path(service: Service, **kwargs) -> Path:
+    """
+    This method creates a path object that belongs to the given service. The service is set without the backref so
+    that the path is not added to the service's paths. Thereby, the shared service object is not modified by the
+    enumeration and analysis threads and it does not keep the paths and their file contents alive.
+    """
+    result = Path(**kwargs)
+    set_committed_value(result, "service", service)
+    return result
+
+
+def set_file(path: Path, file: File) -> None:
+    """
+    This method sets the file of the given path object without the backref. Otherwise, the path and its file would
+    reference each other and the file content would only be released by the garbage collector's cycle detection, which
+    rarely examines the long-lived queued path objects.
+    """
+    set_committed_value(path, "file", file)
+
+
+def init_content_worker(domain_names: list = None) -> None:
+    """
+    This method initializes a process of the content analysis process pool by loading the file content match rules.
+    """
+    global _worker_content_matcher
+    config = FileHunterConfig(domain_names=domain_names)
+    _worker_content_matcher = ContentMatcher(config.matching_rules[SearchLocation.file_content.name])
+
+
+def find_content_rule(rules: list, content: bytes) -> int:
+    """
+    This method determines the first of the given file content match rules that matches the given content.
+    :param rules: The file content match rules sorted by their priority.
+    :param content: The file content that shall be analyzed.
+    :return: The index of the matching rule within the given rules or None if no rule matches.
+    """
+    # most rules contain a literal that is looked up in the lower case content before the regex is executed
+    lower_content = content.lower()
+    for index, rule in enumerate(rules):
+        if rule.is_content_match(content, lower_content):
+            return index
+    return None
+
+
+def match_file_content(content: bytes) -> int:
+    """
+    This method is executed by the content analysis process pool and determines the first file content match rule that
+    matches the given content.
+    :param content: The file content that shall be analyzed.
+    :return: The index of the matching rule within the sorted file content match rules or None if no rule matches.
+    """
+    return _worker_content_matcher.find(content)
+
+
+class ContentMatcher:
+    """
+    This class determines the first of the given file content match rules that matches a file's content. If the
+    optional module hyperscan is installed, then all rules that hyperscan supports are matched in a single pass over the
+    content. The remaining rules are matched by module re. Instances must not be shared between threads as hyperscan's
+    scratch space is not thread-safe.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self._database = None
+        self._supported = set()
+        if hyperscan and rules:
+            flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH
+            expressions = {}
+            for index, rule in enumerate(rules):
+                expression = rule.search_pattern.encode("utf-8")
+                try:
+                    hyperscan.Database().compile(expressions=[expression], flags=flags)
+                    expressions[index] = expression
+                except hyperscan.error:
+                    logger.debug("hyperscan does not support search pattern: {}".format(rule.search_pattern))
+            if expressions:
+                self._database = hyperscan.Database()
+                self._database.compile(expressions=list(expressions.values()),
+                                       ids=list(expressions.keys()),
+                                       flags=flags)
+                self._supported = set(expressions.keys())
+
+    def find(self, content: bytes) -> int:
+        """
+        This method determines the first file content match rule that matches the given content.
+        :param content: The file content that shall be analyzed.
+        :return: The index of the matching rule within the rules or None if no rule matches.
+        """
+        if self._database is None:
+            return find_content_rule(self.rules, content)
+        matches = set()
+        self._database.scan(content, match_event_handler=lambda index, start, end, flags, context: matches.add(index))
+        lower_content = None
+        for index, rule in enumerate(self.rules):
+            if index in self._supported:
+                if index in matches:
+                    return index
+            else:
+                if lower_content is None:
+                    lower_content = content.lower()
+                if rule.is_content_match(content, lower_content):
+                    return index
+        return None
+
+
+class BatchedFileQueue:
+    """
+    This class implements the queue between the file hunter and the analysis threads. It provides the same interface
+    as queue.Queue but additionally allows adding and removing path objects in batches so that the lock is only
+    acquired once per batch and not once per file. Besides the number of items, the queue can be bounded by the
+    total size of the queued file contents.
+    """
+
+    def __init__(self, maxsize: int = 0, maxbytes: int = 0):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._mutex = Lock()
+        self._not_empty = Condition(self._mutex)
+        self._not_full = Condition(self._mutex)
+        self._all_tasks_done = Condition(self._mutex)
+        self._unfinished_tasks = 0
+        self._waiting_consumers = 0
+
+    def qsize(self) -> int:
+        with self._mutex:
+            return len(self._queue)
+
+    @staticmethod
+    def item_size(item) -> int:
+        """
+        This method returns the number of content bytes that the given path object holds in memory.
+        """
+        file = getattr(item, "file", None)
+        return len(file.content) if file is not None and file.content else 0
+
+    def _is_full(self, size: int) -> bool:
+        if 0 < self.maxsize <= len(self._queue):
+            return True
+        return 0 < self.maxbytes < self._queued_bytes + size and len(self._queue) > 0
+
+    def put(self, item) -> None:
+        self.put_many([item])
+
+    def put_many(self, items: list) -> None:
+        """
+        This method adds the given items to the queue. If the queue is full, then this method blocks until the
+        consumers removed enough items.
+        """
+        with self._not_full:
+            added = 0
+            for item in items:
+                size = self.item_size(item)
+                while self._is_full(size):
+                    if added:
+                        self._not_empty.notify(added)
+                        added = 0
+                    self._not_full.wait()
+                self._queue.append((item, size))
+                self._queued_bytes += size
+                self._unfinished_tasks += 1
+                added += 1
+            if added:
+                self._not_empty.notify(added)
+
+    def get(self):
+        return self.get_many(1)[0]
+
+    def get_many(self, max_items: int) -> list:
+        """
+        This method removes up to max_items items from the queue. If the queue is empty, then this method blocks until
+        at least one item is available.
+        """
+        with self._not_empty:
+            while not self._queue:
+                self._waiting_consumers += 1
+                self._not_empty.wait()
+                self._waiting_consumers -= 1
+            # leave a fair share of the available items to the other waiting consumers
+            count = min(max_items, max(1, len(self._queue) // (self._waiting_consumers + 1)))
+            result = []
+            for _ in range(count):
+                item, size = self._queue.popleft()
+                self._queued_bytes -= size
+                result.append(item)
+            self._not_full.notify(count)
+            return result
+
+    def task_done(self, count: int = 1) -> None:
+        """
+        This method marks the given number of previously obtained items as processed.
+        """
+        with self._all_tasks_done:
+            unfinished = self._unfinished_tasks - count
+            if unfinished < 0:
+                raise ValueError("task_done() called too many times")
+            if unfinished == 0:
+                self._all_tasks_done.notify_all()
+            self._unfinished_tasks = unfinished
+
+    def join(self) -> None:
+        """
+        This method blocks until all items in the queue have been obtained and processed.
+        """
+        with self._all_tasks_done:
+            while self._unfinished_tasks:
+                self._all_tasks_done.wait()
+
+
+class DatabaseWriter(Thread):
+    """
+    This class implements the only thread that writes analysis results into the database. The analysis threads hand
+    over their results via method put and the writer commits them in batches of up to batch_size results. After the
+    first result of a batch arrived, the writer waits up to batch_delay seconds for further results.
+    """
+
+    def __init__(self,
+                 engine: Engine,
+                 workspace: str,
+                 batch_size: int = DB_BATCH_SIZE,
+                 batch_delay: float = DB_BATCH_DELAY):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.workspace = workspace
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue = Queue()
+        # primary keys of services and match rules that exist in the database
+        self._cache = {}
+
+    def put(self, path: Path, rule: MatchRule = None, file_id: int = None) -> None:
+        """
+        This method hands the given analysis result over to the writer.
+        """
+        self._queue.put((self.write, (path, rule, file_id)))
+
+    def put_archive(self, sha256_value: str, results: list) -> None:
+        """
+        This method hands the recorded analysis results of an extracted archive over to the writer. As the results are
+        written in order, the archive's member files are already stored in the database at that time.
+        """
+        self._queue.put((self.write_archive, (sha256_value, results)))
+
+    def stop(self) -> None:
+        """
+        This method writes all pending analysis results and afterwards terminates the writer.
+        """
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        stop = False
+        while not stop:
+            records = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_delay
+            while records[-1] is not None and len(records) < self.batch_size:
+                try:
+                    timeout = deadline - time.monotonic()
+                    records.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except Empty:
+                    break
+            if records[-1] is None:
+                stop = True
+                records.pop()
+            if records:
+                self._write_batch(records)
+
+    def _write_batch(self, records: list) -> None:
+        """
+        This method writes the given analysis results in one transaction. If the transaction fails, then each result
+        is written in its own transaction so that one failing result does not discard the others.
+        """
+        try:
+            with self.engine.session_scope() as session:
+                workspace = self.engine.get_workspace(session, name=self.workspace)
+                for function, arguments in records:
+                    function(self.engine, session, workspace, *arguments, cache=self._cache)
+        except Exception:
+            self._cache.clear()
+            for function, arguments in records:
+                try:
+                    with self.engine.session_scope() as session:
+                        workspace = self.engine.get_workspace(session, name=self.workspace)
+                        function(self.engine, session, workspace, *arguments, cache=self._cache)
+                except Exception as ex:
+                    self._cache.clear()
+                    logger.exception(ex)
+
+    @staticmethod
+    def write(engine: Engine,
+              session,
+              workspace: Workspace,
+              path: Path,
+              rule: MatchRule = None,
+              file_id: int = None,
+              cache: dict = None) -> None:
+        """
+        This method adds the given analysis result to the given session.
+        :param cache: Dictionary that caches the primary keys of already added services and match rules. It must be
+        cleared, if the session is rolled back.
+        """
+        cache = {} if cache is None else cache
+        address = path.service.host.address
+        key = ("service", address, path.service.port)
+        service_id = cache.get(key)
+        if service_id is None:
+            host = engine.add_host(session=session, workspace=workspace, address=address)
+            service = engine.add_service(session=session,
+                                         port=path.service.port,
+                                         name=path.service.name,
+                                         host=host)
+            service_id = cache[key] = service.id
+        if rule:
+            key = ("rule", rule.search_location, rule.search_pattern)
+            rule_id = cache.get(key)
+            if rule_id is None:
+                match_rule = engine.add_match_rule(session=session,
+                                                   search_location=rule.search_location,
+                                                   search_pattern=rule.search_pattern,
+                                                   relevance=rule.relevance,
+                                                   accuracy=rule.accuracy,
+                                                   category=rule.category)
+                cache[key] = match_rule.id
+            else:
+                match_rule = session.query(MatchRule).get(rule_id)
+            file = engine.add_file(session=session,
+                                   workspace=workspace,
+                                   file=path.file)
+            file.add_match_rule(match_rule)
+        else:
+            file = session.query(File).get(file_id)
+        engine.add_path(session=session,
+                        service_id=service_id,
+                        service=None,
+                        full_path=path.full_path,
+                        share=path.share,
+                        file=file,
+                        access_time=path.access_time,
+                        modified_time=path.modified_time,
+                        creation_time=path.creation_time)
+
+    @staticmethod
+    def write_archive(engine: Engine,
+                      session,
+                      workspace: Workspace,
+                      sha256_value: str,
+                      results: list,
+                      cache: dict = None) -> None:
+        """
+        This method adds the given extracted archive together with the files of its recorded analysis results to the
+        given session so that the archive does not have to be extracted again in subsequent runs.
+        :param results: The (relative path, share, access time, modified time, creation time, rule, file id, sha256
+        value) tuples recorded during the archive's extraction.
+        :param cache: Not used but required by the writer's interface.
+        """
+        members = []
+        for relative_path, share, access_time, modified_time, creation_time, rule, file_id, file_sha256 in results:
+            if file_id is None:
+                file = engine.get_file(session=session, workspace=workspace, sha256_value=file_sha256)
+                if not file:
+                    # the member's result could not be written
+                    continue
+                file_id = file.id
+            members.append(ArchiveMember(relative_path=relative_path,
+                                         share=share,
+                                         access_time=access_time,
+                                         modified_time=modified_time,
+                                         creation_time=creation_time,
+                                         file_id=file_id))
+        engine.add_archive(session=session, workspace=workspace, sha256_value=sha256_value, members=members)
+
 
 class BaseAnalyzer(Thread):
     """
     This class implements all base functionalities for collectors and analyzers
     """
-
-    DB_OPERATION_MUTEX = Lock()
+    # indices of the file content rules that matched already analyzed contents (sha256 value: index or None)
+    CONTENT_RESULTS = OrderedDict()
+    CONTENT_RESULTS_LOCK = Lock()
 
     def __init__(self,
                  engine: Engine,
                  args: argparse.Namespace,
                  config: FileHunterConfig,
-                 file_queue: Queue,
+                 file_queue: BatchedFileQueue,
+                 executor: Executor = None,
+                 db_writer: "DatabaseWriter" = None,
                  daemon: bool = False):
         super().__init__(daemon=daemon)
         self.engine = engine
         self.file_queue = file_queue
+        self.executor = executor
+        self.db_writer = db_writer
         self._args = args
         self.workspace = args.workspace
         self.config = config
+        self._workspace = None
+        self._db_cache = {}
+        self._content_matcher = None
+
+    def _get_workspace(self, session) -> Workspace:
+        """
+        This method returns the analyzer's workspace object. The workspace is only queried once. Afterwards, a cached
+        copy is merged into the given session without issuing a SQL query.
+        """
+        if self._workspace is None:
+            workspace = self.engine.get_workspace(session, name=self.workspace)
+            cached = Workspace(id=workspace.id, name=workspace.name)
+            make_transient_to_detached(cached)
+            self._workspace = cached
+        else:
+            workspace = session.merge(self._workspace, load=False)
+        return workspace
 
     def is_file_size_below_threshold(self, path: Path, size: int) -> bool:
         """
@@ -66,41 +524,50 @@ class BaseAnalyzer(Thread):
 
     def add_content(self, path: Path, rule: MatchRule = None, file: File = None):
         """
-        This method adds the rule matching result to the database.
+        This method adds the rule matching result to the database. If a database writer is available, then the result
+        is handed over to it. Otherwise, the result is written immediately, which is only intended for single-threaded
+        use (e.g., unit tests).
         """
         if rule and file:
             raise ValueError("parameters rule and file are mutual exclusive")
         elif not rule and not file:
             raise ValueError("either parameter rule or file must be given")
-        with BaseAnalyzer.DB_OPERATION_MUTEX:
+        self._store_content(path=path, rule=rule, file_id=file.id if file else None)
+
+    def _store_content(self, path: Path, rule: MatchRule = None, file_id: int = None):
+        """
+        This method writes the given rule matching result or hands it over to the database writer.
+        """
+        if self.db_writer:
+            self.db_writer.put(path=path, rule=rule, file_id=file_id)
+        else:
+            try:
+                with self.engine.session_scope() as session:
+                    DatabaseWriter.write(engine=self.engine,
+                                         session=session,
+                                         workspace=self._get_workspace(session),
+                                         path=path,
+                                         rule=rule,
+                                         file_id=file_id,
+                                         cache=self._db_cache)
+            except Exception:
+                self._db_cache.clear()
+                raise
+
+    def _store_archive(self, sha256_value: str, results: list):
+        """
+        This method writes the given recorded analysis results of an extracted archive or hands them over to the
+        database writer.
+        """
+        if self.db_writer:
+            self.db_writer.put_archive(sha256_value=sha256_value, results=results)
+        else:
             with self.engine.session_scope() as session:
-                workspace = self.engine.get_workspace(session, name=self.workspace)
-                host = self.engine.add_host(session=session,
-                                            workspace=workspace,
-                                            address=path.service.host.address)
-                service = self.engine.add_service(session=session,
-                                                  port=path.service.port,
-                                                  name=path.service.name,
-                                                  host=host)
-                if rule:
-                    match_file = self.engine.add_match_rule(session=session,
-                                                            search_location=rule.search_location,
-                                                            search_pattern=rule.search_pattern,
-                                                            relevance=rule.relevance,
-                                                            accuracy=rule.accuracy,
-                                                            category=rule.category)
-                    file = self.engine.add_file(session=session,
-                                                workspace=workspace,
-                                                file=path.file)
-                    file.add_match_rule(match_file)
-                self.engine.add_path(session=session,
-                                     service=service,
-                                     full_path=path.full_path,
-                                     share=path.share,
-                                     file=file,
-                                     access_time=path.access_time,
-                                     modified_time=path.modified_time,
-                                     creation_time=path.creation_time)
+                DatabaseWriter.write_archive(engine=self.engine,
+                                             session=session,
+                                             workspace=self._get_workspace(session),
+                                             sha256_value=sha256_value,
+                                             results=results)
 
     def _analyze_content(self, path: Path) -> FileRelevance:
         """
@@ -109,14 +576,47 @@ class BaseAnalyzer(Thread):
         :return: True if file is of relevance
         """
         result = None
-        for rule in self.config.matching_rules[SearchLocation.file_content.name]:
-            if rule.is_match(path):
-                logger.info("Match: {} ({})".format(str(path), rule.get_text(not self._args.nocolor)))
-                result = rule.relevance
-                self.add_content(path=path, rule=rule)
-                break
+        rules = self.config.matching_rules[SearchLocation.file_content.name]
+        sha256_value = path.file.sha256_value
+        # files with the same content (e.g., copies or backups) are only matched once
+        with BaseAnalyzer.CONTENT_RESULTS_LOCK:
+            index = BaseAnalyzer.CONTENT_RESULTS.get(sha256_value, -1)
+            if index != -1:
+                BaseAnalyzer.CONTENT_RESULTS.move_to_end(sha256_value)
+        if index == -1:
+            if self.executor:
+                # the regular expressions are matched by the process pool as they are CPU-bound
+                index = self.executor.submit(match_file_content, path.file.content).result()
+            else:
+                if self._content_matcher is None:
+                    self._content_matcher = ContentMatcher(rules)
+                index = self._content_matcher.find(path.file.content)
+            with BaseAnalyzer.CONTENT_RESULTS_LOCK:
+                BaseAnalyzer.CONTENT_RESULTS[sha256_value] = index
+                if len(BaseAnalyzer.CONTENT_RESULTS) > CONTENT_CACHE_SIZE:
+                    BaseAnalyzer.CONTENT_RESULTS.popitem(last=False)
+        rule = rules[index] if index is not None else None
+        if rule:
+            # the rule's text is only assembled, if it is actually logged
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Match: %s (%s)", path, rule.get_text(not self._args.nocolor))
+            result = rule.relevance
+            self.add_content(path=path, rule=rule)
         return result
 
+    def _analyze_path_above_threshold(self, path: Path, file_size: int) -> None:
+        """
+        This method analyzes the full path and name of a file whose content is not obtained because its size is above
+        the threshold. Instead of the content, a placeholder is stored for matching files.
+        :param path: The path object whose name shall be analyzed.
+        :param file_size: The file's size in bytes.
+        """
+        set_file(path, File(content=ABOVE_THRESHOLD_CONTENT % (str(path).encode("utf-8"), file_size)))
+        path.file.size_bytes = file_size
+        relevance = self._analyze_path_name(path)
+        if self._args.debug and not relevance:
+            logger.debug("ignoring file (threshold: above, size: %d): %s", file_size, path)
+
     def _analyze_path_name(self, path: Path) -> FileRelevance:
         """
         This method analyzes the file's name for interesting information.
@@ -124,19 +624,12 @@ class BaseAnalyzer(Thread):
         :return: True if file is of relevance
         """
         result = None
-        # First we search the full path
-        for rule in self.config.matching_rules[SearchLocation.full_path.name]:
-            if rule.is_match(path):
-                logger.info("Match: {} ({})".format(str(path), rule.get_text(not self._args.nocolor)))
-                result = rule.relevance
-                self.add_content(rule=rule, path=path)
-                break
-        else:
-            # If nothing is found, then we search the file name
-            for rule in self.config.matching_rules[SearchLocation.file_name.name]:
-                if rule.is_match(path):
-                    logger.info("Match: {} ({})".format(str(path), rule.get_text(not self._args.nocolor)))
-                    result = rule.relevance
-                    self.add_content(rule=rule, path=path)
-                    break
+        # First we search the full path. If nothing is found, then we search the file name
+        rule = self.config.find_path_name_rule(SearchLocation.full_path, path) or \
+            self.config.find_path_name_rule(SearchLocation.file_name, path)
+        if rule:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Match: %s (%s)", path, rule.get_text(not self._args.nocolor))
+            result = rule.relevance
+            self.add_content(rule=rule, path=path)
         return result
\ No newline at end of file
@@ -22,9 +22,17 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 __version__ = 0.1
 
+import hashlib
 import argparse
 import logging
+from datetime import timezone
+from queue import Queue
+from threading import Lock
+from threading import Thread
 from hunters.core import BaseAnalyzer
+from hunters.core import QUEUE_BATCH_SIZE
+from database.model import Path
+from database.model import File
 from database.model import Host
 from database.model import Service
 from database.model import Workspace
@@ -34,6 +42,29 @@ from database.model import FileRelevance
 logger = logging.getLogger('smb')
 
 
+class ContentReceiver:
+    """
+    This class collects the blocks of a downloaded file in memory and computes the SHA256 value of each block right
+    after it was received. Thereby, the file neither has to be written to a temporary file nor hashed again.
+    """
+
+    def __init__(self):
+        self.content = bytearray()
+        self._sha256 = hashlib.sha256()
+
+    def write(self, block: bytes) -> None:
+        self.content.extend(block)
+        self._sha256.update(block)
+
+    def get_file(self) -> File:
+        """
+        This method returns the file object containing the received content.
+        """
+        result = File()
+        result.set_content(self.content, self._sha256.hexdigest())
+        return result
+
+
 class BaseSensitiveFileHunter(BaseAnalyzer):
     """
     This class implements the core functionality to hunt for files.
@@ -53,27 +84,27 @@ class BaseSensitiveFileHunter(BaseAnalyzer):
         self.service.workspace = Workspace(name=args.workspace)
         self.verbose = args.verbose
         self.reanalyze = args.reanalyze
+        self.excluded_directories = set(args.exclude_dir or [])
         self.port = port
         self.address = address
         self.temp_dir = temp_dir
+        self._batch = []
+        self._batch_lock = Lock()
+        self._known_paths = {}
         # we add the current host and service to the database so that the consumer threads can use them
         with self.engine.session_scope() as session:
-            workspace = self.engine.get_workspace(session, name=args.workspace)
+            workspace = self._get_workspace(session)
             host = self.engine.add_host(session=session,
                                         workspace=workspace,
                                         address=address)
-            self.engine.add_service(session=session,
-                                    port=port,
-                                    name=service_name,
-                                    host=host)
-            for match_rules in self.config.matching_rules.values():
-                for match_rule in match_rules:
-                    self.engine.add_match_rule(session=session,
-                                               search_location=match_rule.search_location,
-                                               search_pattern=match_rule.search_pattern,
-                                               relevance=match_rule.relevance,
-                                               accuracy=match_rule.accuracy,
-                                               category=match_rule.category)
+            # the service's id is kept so that it can be looked up and updated without joining host and workspace
+            self.service_id = self.engine.add_service(session=session,
+                                                      port=port,
+                                                      name=service_name,
+                                                      host=host).id
+            self.engine.add_match_rules(session=session,
+                                        match_rules=[match_rule for match_rules in self.config.matching_rules.values()
+                                                     for match_rule in match_rules])
 
     @staticmethod
     def add_argparse_arguments(parser: argparse.ArgumentParser) -> None:
@@ -86,6 +117,21 @@ class BaseSensitiveFileHunter(BaseAnalyzer):
         parser.add_argument('-r', '--reanalyze', action="store_true", help='reanalyze already analyzed services')
         parser.add_argument('-w', '--workspace', type=str, required=True, help='the workspace used for the enumeration')
         parser.add_argument('-t', '--threads', type=int, default=10, help='number of analysis threads')
+        parser.add_argument('--threads-mode', choices=["process", "thread"], default="process",
+                            help='if process, then the analysis threads match file contents in a pool of -t '
+                                 'processes. use thread, if the analysis is I/O-bound')
+        parser.add_argument('--exclude-dir', type=str, action="append", metavar="NAME",
+                            help='name of a directory (e.g., node_modules) whose content is not enumerated. this '
+                                 'argument can be specified multiple times')
+
+    def set_complete(self) -> None:
+        """
+        This method marks the enumerated service as completely analyzed.
+        """
+        with self.engine.session_scope() as session:
+            session.query(Service) \
+                .filter(Service.id == self.service_id) \
+                .update({Service.complete: True}, synchronize_session=False)
 
     def enumerate(self):
         """
@@ -94,18 +140,94 @@ class BaseSensitiveFileHunter(BaseAnalyzer):
         """
         # Determine if service was analyzed before
         with self.engine.session_scope() as session:
-            service = session.query(Service) \
-                .join(Host) \
-                .join(Workspace) \
-                .filter(Workspace.name == self.service.workspace.name,
-                        Host.address == self.address,
-                        Service.port == self.port).one()
+            service = session.query(Service).get(self.service_id)
             complete = service.complete
+            if not complete or self.reanalyze:
+                self._known_paths = self.engine.get_known_paths(session, service)
         if not complete or self.reanalyze:
             self._enumerate()
+            self._flush()
         else:
             logger.info("skipping service as it was already analyzed")
 
+    def is_known(self, path: Path, file_size: int) -> bool:
+        """
+        This method determines whether the given path was already analyzed and its file has not changed since then. In
+        this case, the file's content does not have to be obtained again.
+        :param path: The path object whose modification time and share are already set.
+        :param file_size: The file's size in bytes.
+        """
+        modified_time = path.modified_time
+        if modified_time is None:
+            return False
+        if modified_time.tzinfo:
+            modified_time = modified_time.astimezone(timezone.utc).replace(tzinfo=None)
+        return self._known_paths.get((path.share or "", path.full_path)) == (modified_time, file_size)
+
+    def _enqueue(self, path: Path) -> None:
+        """
+        This method buffers the given path object and hands the buffered path objects over to the analysis threads
+        as soon as a complete batch is available.
+        """
+        batch = None
+        with self._batch_lock:
+            self._batch.append(path)
+            if len(self._batch) >= QUEUE_BATCH_SIZE:
+                batch, self._batch = self._batch, []
+        if batch:
+            self.file_queue.put_many(batch)
+
+    def _flush(self) -> None:
+        """
+        This method hands all buffered path objects over to the analysis threads.
+        """
+        with self._batch_lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self.file_queue.put_many(batch)
+
+    def _enumerate_concurrently(self, clients: list, roots: list) -> None:
+        """
+        This method enumerates the directory trees below the given root directories with one thread per given client
+        connection. The threads share a queue of directories, which they enumerate via _enumerate_directory.
+        """
+        directories = Queue()
+        for root in roots:
+            directories.put(root)
+        workers = [Thread(target=self._enumerate_directories, args=(client, directories), daemon=True)
+                   for client in clients]
+        for worker in workers:
+            worker.start()
+        directories.join()
+        # stop the worker threads
+        for _ in workers:
+            directories.put(None)
+        for worker in workers:
+            worker.join()
+
+    def _enumerate_directories(self, client, directories: Queue) -> None:
+        """
+        This method is executed by each enumeration thread and enumerates the directories of the given queue using the
+        given connection until it obtains None.
+        """
+        while True:
+            cwd = directories.get()
+            try:
+                if cwd is None:
+                    break
+                self._enumerate_directory(client, cwd, directories)
+            except Exception as ex:
+                logger.exception(ex)
+            finally:
+                directories.task_done()
+
+    def _enumerate_directory(self, client, cwd: str, directories: Queue) -> None:
+        """
+        This method enumerates all files in the given directory and adds all subdirectories to the given queue. It
+        must be implemented by all subclasses that use _enumerate_concurrently.
+        """
+        raise NotImplementedError("this method must be implemented by all subclasses")
+
     def _enumerate(self):
         """
         This method enumerates all files on the given service.
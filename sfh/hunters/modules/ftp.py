@@ -22,20 +22,23 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 __version__ = 0.1
 
-import os
 import ftplib
 import logging
 import getpass
 import argparse
-import tempfile
+from queue import Queue
 from datetime import datetime
-from database.model import Path
-from database.model import File
 from database.model import HunterType
+from hunters.core import create_path
+from hunters.core import set_file
 from hunters.modules.core import BaseSensitiveFileHunter
+from hunters.modules.core import ContentReceiver
 
 logger = logging.getLogger('ftp')
 
+# number of bytes that are requested at once when a file is downloaded
+FTP_BLOCK_SIZE = 65536
+
 
 class FtpSensitiveFileHunter(BaseSensitiveFileHunter):
     """
@@ -49,17 +52,25 @@ class FtpSensitiveFileHunter(BaseSensitiveFileHunter):
         if args.prompt_for_password:
             self.password = getpass.getpass(prompt="password: ")
         self.tls = args.tls
-        if self.tls:
-            self.client = ftplib.FTP_TLS()
-            self.client.connect(self.service.host.address, self.service.port)
-            self.client.login(user=self.username, passwd=self.password, secure=False)
-        else:
-            self.client = ftplib.FTP()
-            self.client.connect(self.service.host.address, self.service.port)
-            self.client.login(self.username, self.password)
+        self.connections = max(1, args.connections)
+        self.client = self._connect()
         if self.verbose:
             self.client.getwelcome()
 
+    def _connect(self) -> ftplib.FTP:
+        """
+        This method creates a new connection to the FTP service and authenticates it.
+        """
+        if self.tls:
+            client = ftplib.FTP_TLS()
+            client.connect(self.service.host.address, self.service.port)
+            client.login(user=self.username, passwd=self.password, secure=False)
+        else:
+            client = ftplib.FTP()
+            client.connect(self.service.host.address, self.service.port)
+            client.login(self.username, self.password)
+        return client
+
     def __del__(self):
         if self.client:
             self.client.close()
@@ -78,6 +89,8 @@ class FtpSensitiveFileHunter(BaseSensitiveFileHunter):
                                  'then the specified values become additional file content matching rules with'
                                  'search pattern: "USERDOMAIN[/\\]\\w+". the objective is the identification domain '
                                  'user names in files.')
+        parser.add_argument('-c', '--connections', type=int, default=4,
+                            help='number of concurrent FTP connections used to list directories and download files')
         ftp_target_group = parser.add_argument_group('target information')
         ftp_target_group.add_argument('--host', type=str, metavar="HOST", help="the target FTP service's IP address")
         ftp_target_group.add_argument('--port', type=int, default=21, metavar="PORT",
@@ -91,49 +104,58 @@ class FtpSensitiveFileHunter(BaseSensitiveFileHunter):
         parser_ftp_credential_group.add_argument('-P', dest="prompt_for_password", action="store_true",
                                                  help='ask for the password via an user input prompt')
 
-    def _enumerate(self, cwd: str = None) -> None:
+    def _enumerate(self) -> None:
         """
         This method enumerates all files on the given service.
         :return:
         """
-        cwd = self.client.pwd() if not cwd else cwd
+        clients = [self.client] + [self._connect() for _ in range(self.connections - 1)]
+        self._enumerate_concurrently(clients, [self.client.pwd()])
+        # close the additional connections
+        for client in clients[1:]:
+            client.close()
+
+    def _enumerate_directory(self, client: ftplib.FTP, cwd: str, directories: Queue) -> None:
+        """
+        This method enumerates all files in the given directory and adds all subdirectories to the given queue.
+        :return:
+        """
+        # FTP paths always use forward slashes, independent of the local platform
+        prefix = cwd if cwd.endswith("/") else cwd + "/"
         try:
-            for name, facts in self.client.mlsd(cwd):
-                full_path = os.path.join(cwd, name)
+            for name, facts in client.mlsd(cwd):
+                full_path = prefix + name
                 item_type = facts["type"]
                 file_size = int(facts["size"]) if "size" in facts else 0
                 if item_type == "dir":
-                    self._enumerate(os.path.join(cwd, full_path))
+                    if name in self.excluded_directories:
+                        logger.debug("skip excluded directory: %s", full_path)
+                    else:
+                        directories.put(full_path)
                 elif item_type == "file":
                     last_modified = facts["modify"]
                     modified_time = datetime.strptime(last_modified, '%Y%m%d%H%M%S') \
                         if last_modified else None
-                    path = Path(service=self.service,
-                                full_path=full_path,
-                                modified_time=modified_time)
-                    if self.is_file_size_below_threshold(path, file_size):
+                    path = create_path(self.service,
+                                       full_path=full_path,
+                                       modified_time=modified_time)
+                    if self.is_known(path, file_size):
+                        logger.debug("skipping unchanged file: %s", path)
+                    elif self.is_file_size_below_threshold(path, file_size):
                         try:
                             # Obtain file content
-                            with tempfile.NamedTemporaryFile(dir=self.temp_dir) as temp:
-                                with open(temp.name, "wb") as file:
-                                    self.client.retrbinary('RETR {}'.format(full_path), file.write)
-                                with open(temp.name, "rb") as file:
-                                    content = file.read()
-                            path.file = File(content=content)
+                            receiver = ContentReceiver()
+                            client.retrbinary('RETR {}'.format(full_path), receiver.write, blocksize=FTP_BLOCK_SIZE)
+                            set_file(path, receiver.get_file())
                             # Add file to queue
-                            self.file_queue.put(path)
+                            self._enqueue(path)
                         except ftplib.error_perm:
                             # Catch permission exception, if FTP user does not have read permission on a certain file
-                            logger.error("cannot read file: {}".format(str(path)), exc_info=self._args.verbose)
+                            logger.error("cannot read file: %s", path, exc_info=self._args.verbose)
                     elif file_size > 0:
-                        path.file = File(content="[file ({}) not imported as file size ({}) "
-                                                 "is above threshold]".format(str(path), file_size).encode('utf-8'))
-                        path.file.size_bytes = file_size
-                        relevance = self._analyze_path_name(path)
-                        if self._args.debug and not relevance:
-                            logger.debug("ignoring file (threshold: above, size: {}): {}".format(file_size, str(path)))
+                        self._analyze_path_above_threshold(path, file_size)
                 else:
-                    logger.debug("skip type item: {} (type: {})".format(name, item_type))
+                    logger.debug("skip type item: %s (type: %s)", name, item_type)
         except ftplib.error_perm:
             # Catch permission exception, if FTP user does not have read permission on a certain directory
-            logger.error("cannot access item: {}/{}".format(str(self.service), str(cwd)), exc_info=self._args.verbose)
+            logger.error("cannot access item: %s/%s", self.service, cwd, exc_info=self._args.verbose)
@@ -23,14 +23,18 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 __version__ = 0.1
 
 import os
-import glob
 import logging
 import argparse
 from datetime import datetime
 from datetime import timezone
+from threading import BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
 from database.model import Path
 from database.model import File
 from database.model import HunterType
+from hunters.core import scan_files
+from hunters.core import create_path
+from hunters.core import set_file
 from hunters.modules.core import BaseSensitiveFileHunter
 
 logger = logging.getLogger('nfs')
@@ -44,6 +48,7 @@ class LocalSensitiveFileHunter(BaseSensitiveFileHunter):
     def __init__(self, args: argparse.Namespace, **kwargs):
         super().__init__(args, address="127.0.0.1", service_name=HunterType.local, **kwargs)
         self.path = [os.path.abspath(item) for item in args.path]
+        self.read_threads = max(1, args.read_threads)
 
     @staticmethod
     def add_argparse_arguments(parser: argparse.ArgumentParser) -> None:
@@ -59,37 +64,44 @@ class LocalSensitiveFileHunter(BaseSensitiveFileHunter):
                                  'then the specified values become additional file content matching rules with'
                                  'search pattern: "USERDOMAIN[/\\]\\w+". the objective is the identification domain '
                                  'user names in files.')
+        parser.add_argument('--read-threads', type=int, default=4,
+                            help='number of threads that concurrently read the enumerated files')
 
     def _enumerate(self) -> None:
         """
         This method enumerates all files on the given service.
         :return:
         """
-        for path in self.path:
-            path = path if path[-1] == "/" else path + "/"
-            for item in glob.iglob(path + "**", recursive=True):
-                stats = os.stat(item)
-                if os.path.isfile(item):
-                    path = Path(service=self.service,
-                                full_path=item,
-                                access_time=datetime.fromtimestamp(stats.st_atime, tz=timezone.utc),
-                                modified_time=datetime.fromtimestamp(stats.st_mtime, tz=timezone.utc),
-                                creation_time=datetime.fromtimestamp(stats.st_ctime, tz=timezone.utc))
-                    if self.is_file_size_below_threshold(path, stats.st_size):
-                        try:
-                            with open(item, "rb") as file:
-                                content = file.read()
-                            path.file = File(content=content)
-                            # Add file to queue
-                            self.file_queue.put(path)
-                        except PermissionError:
-                            # Catch permission exception, if FTP user does not have read permission on a certain file
-                            logger.error("cannot read file: {}".format(str(path)), exc_info=self._args.verbose)
+        # the semaphore limits the number of files that are read or waiting to be read
+        pending = BoundedSemaphore(4 * self.read_threads)
+        with ThreadPoolExecutor(max_workers=self.read_threads) as pool:
+            for directory in self.path:
+                for entry in scan_files(directory, self.excluded_directories):
+                    stats = entry.stat(follow_symlinks=False)
+                    path = create_path(self.service,
+                                       full_path=entry.path,
+                                       access_time=datetime.fromtimestamp(stats.st_atime, tz=timezone.utc),
+                                       modified_time=datetime.fromtimestamp(stats.st_mtime, tz=timezone.utc),
+                                       creation_time=datetime.fromtimestamp(stats.st_ctime, tz=timezone.utc))
+                    if self.is_known(path, stats.st_size):
+                        logger.debug("skipping unchanged file: %s", path)
+                    elif self.is_file_size_below_threshold(path, stats.st_size):
+                        pending.acquire()
+                        pool.submit(self._read_file, path, entry.path, pending)
                     elif stats.st_size > 0:
-                        path.file = File(content="[file ({}) not imported as file size ({}) "
-                                                 "is above threshold]".format(str(path), stats.st_size).encode('utf-8'))
-                        path.file.size_bytes = stats.st_size
-                        relevance = self._analyze_path_name(path)
-                        if self._args.debug and not relevance:
-                            logger.debug("ignoring file (threshold: above, size: {}): {}".format(stats.st_size,
-                                                                                                 str(path)))
+                        self._analyze_path_above_threshold(path, stats.st_size)
+
+    def _read_file(self, path: Path, file_name: str, pending: BoundedSemaphore) -> None:
+        """
+        This method is executed by the read threads. It reads the given file and adds it to the queue.
+        """
+        try:
+            set_file(path, File.read_file(file_name))
+            # Add file to queue
+            self._enqueue(path)
+        except PermissionError:
+            logger.error("cannot read file: %s", path, exc_info=self._args.verbose)
+        except Exception as ex:
+            logger.exception(ex)
+        finally:
+            pending.release()
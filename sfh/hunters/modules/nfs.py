@@ -22,16 +22,17 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 __version__ = 0.1
 
-import os
 import stat
 import libnfs
 import logging
 import argparse
 from datetime import datetime
 from datetime import timezone
-from database.model import Path
+from queue import Queue
 from database.model import File
 from database.model import HunterType
+from hunters.core import create_path
+from hunters.core import set_file
 from hunters.modules.core import BaseSensitiveFileHunter
 
 logger = logging.getLogger('nfs')
@@ -50,7 +51,14 @@ class NfsSensitiveFileHunter(BaseSensitiveFileHunter):
                                                                             self.path,
                                                                             self.version,
                                                                             self.service.port)
-        self.client = libnfs.NFS(self.connection_string)
+        self.connections = max(1, args.connections)
+        self.client = self._connect()
+
+    def _connect(self) -> libnfs.NFS:
+        """
+        This method creates a new connection to the NFS service.
+        """
+        return libnfs.NFS(self.connection_string)
 
     @staticmethod
     def add_argparse_arguments(parser: argparse.ArgumentParser) -> None:
@@ -66,41 +74,53 @@ class NfsSensitiveFileHunter(BaseSensitiveFileHunter):
                                  'then the specified values become additional file content matching rules with'
                                  'search pattern: "USERDOMAIN[/\\]\\w+". the objective is the identification domain '
                                  'user names in files.')
+        parser.add_argument('-c', '--connections', type=int, default=4,
+                            help='number of concurrent NFS connections used to list directories and download files')
         nfs_target_group = parser.add_argument_group('target information')
         nfs_target_group.add_argument('--host', type=str, metavar="HOST", help="the target NFS service's IP address")
         nfs_target_group.add_argument('--port', type=int, default=2049, metavar="PORT",
                                       help="the target NFS service's port")
         nfs_target_group.add_argument('--path', type=str, metavar="PATH", help="path to enumerate")
 
-    def _enumerate(self, cwd: str = "") -> None:
+    def _enumerate(self) -> None:
         """
         This method enumerates all files on the given service.
         :return:
         """
-        items = self.client.listdir(cwd)
-        for item in items:
+        clients = [self.client] + [self._connect() for _ in range(self.connections - 1)]
+        self._enumerate_concurrently(clients, [""])
+
+    def _enumerate_directory(self, client: libnfs.NFS, cwd: str, directories: Queue) -> None:
+        """
+        This method enumerates all files in the given directory and adds all subdirectories to the given queue.
+        :return:
+        """
+        prefix = cwd + "/" if cwd else ""
+        for item in client.listdir(cwd):
             if item not in [".", ".."]:
-                full_path = os.path.join(cwd, item)
-                stats = self.client.stat(full_path)
+                full_path = prefix + item
+                stats = client.stat(full_path)
                 file_size = stats['size']
                 if stat.S_ISDIR(stats['mode']):
-                    self._enumerate(full_path)
+                    if item in self.excluded_directories:
+                        logger.debug("skip excluded directory: %s", full_path)
+                    else:
+                        directories.put(full_path)
                 else:
-                    path = Path(service=self.service,
-                                full_path=full_path,
-                                access_time=datetime.fromtimestamp(stats['atime']['sec'], tz=timezone.utc),
-                                modified_time=datetime.fromtimestamp(stats['mtime']['sec'], tz=timezone.utc),
-                                creation_time=datetime.fromtimestamp(stats['ctime']['sec'], tz=timezone.utc))
-                    if self.is_file_size_below_threshold(path, file_size):
-                        content = self.client.open(full_path, mode='rb').read()
-                        path.file = File(content=bytes(content))
+                    path = create_path(self.service,
+                                       full_path=full_path,
+                                       access_time=datetime.fromtimestamp(stats['atime']['sec'], tz=timezone.utc),
+                                       modified_time=datetime.fromtimestamp(stats['mtime']['sec'], tz=timezone.utc),
+                                       creation_time=datetime.fromtimestamp(stats['ctime']['sec'], tz=timezone.utc))
+                    if self.is_known(path, file_size):
+                        logger.debug("skipping unchanged file: %s", path)
+                    elif self.is_file_size_below_threshold(path, file_size):
+                        file = client.open(full_path, mode='rb')
+                        try:
+                            set_file(path, File(content=file.read()))
+                        finally:
+                            file.close()
                         # Add file to queue
-                        self.file_queue.put(path)
+                        self._enqueue(path)
                     elif file_size > 0:
-                        path.file = File(content="[file ({}) not imported as file size ({}) "
-                                                 "is above threshold]".format(str(path), file_size).encode('utf-8'))
-                        path.file.size_bytes = file_size
-                        relevance = self._analyze_path_name(path)
-                        if self._args.debug and not relevance:
-                            logger.debug("ignoring file (threshold: above, size: {}): {}".format(file_size,
-                                                                                                 str(path)))
+                        self._analyze_path_above_threshold(path, file_size)
@@ -23,26 +23,29 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 __version__ = 0.1
 
 import re
-import os
 import ntpath
 import getpass
 import logging
 import impacket
 import argparse
-import tempfile
 import datetime
-from database.model import Path
-from database.model import File
+from queue import Queue
 from database.model import HunterType
 from impacket.smbconnection import SMB_DIALECT
 from impacket.smbconnection import SMB2_DIALECT_002
 from impacket.smbconnection import SMB2_DIALECT_21
 from impacket.smbconnection import SMBConnection
 from impacket.smbconnection import FILE_SHARE_READ
+from hunters.core import create_path
+from hunters.core import set_file
 from hunters.modules.core import BaseSensitiveFileHunter
+from hunters.modules.core import ContentReceiver
 
 logger = logging.getLogger('smb')
 
+# format of LM and NT hashes
+HASH_REGEX = re.compile("[0-9a-fA-F]{32}")
+
 
 class SmbSensitiveFileHunter(BaseSensitiveFileHunter):
     """
@@ -80,13 +83,13 @@ class SmbSensitiveFileHunter(BaseSensitiveFileHunter):
             self.password = ''
             self.lm_hash = ''
             self.nt_hash = ''
-        if self.lm_hash and not re.search("^[0-9a-z]{32,32}$", self.lm_hash, re.IGNORECASE):
+        if self.lm_hash and not HASH_REGEX.fullmatch(self.lm_hash):
             raise ValueError("invalid LM hash: {}".format(self.lm_hash))
-        if self.nt_hash and not re.search("^[0-9a-z]{32,32}$", self.nt_hash, re.IGNORECASE):
+        if self.nt_hash and not HASH_REGEX.fullmatch(self.nt_hash):
             raise ValueError("invalid NT hash: {}".format(self.nt_hash))
         self.domain = args.domain
-        self.client = SMBConnection(self.service.host.address, self.service.host.address, sess_port=self.service.port)
-        self.client.login(self.username, self.password, self.domain, self.lm_hash, self.nt_hash)
+        self.connections = max(1, args.connections)
+        self.client = self._connect()
         if self.verbose:
             dialect = self.client.getDialect()
             if dialect == SMB_DIALECT:
@@ -97,8 +100,19 @@ class SmbSensitiveFileHunter(BaseSensitiveFileHunter):
                 logging.info("smbv2.1 dialect used")
             else:
                 logging.info("smbv3.0 dialect used")
+            capabilities = self.client.getIOCapabilities()
+            logging.info("maximum read size: %d bytes, maximum write size: %d bytes",
+                         capabilities['MaxReadSize'], capabilities['MaxWriteSize'])
         self.shares = args.shares if args.shares else self.list_shares()
 
+    def _connect(self) -> SMBConnection:
+        """
+        This method creates a new connection to the SMB service and authenticates it.
+        """
+        client = SMBConnection(self.service.host.address, self.service.host.address, sess_port=self.service.port)
+        client.login(self.username, self.password, self.domain, self.lm_hash, self.nt_hash)
+        return client
+
     def __del__(self):
         if self.client:
             self.client.close()
@@ -116,6 +130,8 @@ class SmbSensitiveFileHunter(BaseSensitiveFileHunter):
                                  'then the specified values become additional file content matching rules with'
                                  'search pattern: "USERDOMAIN[/\\]\\w+". the objective is the identification domain '
                                  'user names in files.')
+        parser.add_argument('-c', '--connections', type=int, default=4,
+                            help='number of concurrent SMB connections used to list directories and download files')
         smb_target_group = parser.add_argument_group('target information')
         smb_target_group.add_argument('--host', type=str, metavar="HOST", help="the target SMB service's IP address")
         smb_target_group.add_argument('--port', type=int, default=445, metavar="PORT",
@@ -145,11 +161,7 @@ class SmbSensitiveFileHunter(BaseSensitiveFileHunter):
         :param path: Path to pathify
         :return:
         """
-        result = ntpath.join(path,'*')
-        result = result.replace('/','\\')
-        result = result.replace('\\\\','\\')
-        result = ntpath.normpath(result)
-        return result
+        return ntpath.normpath(path.replace('/', '\\')).rstrip('\\') + '\\*'
 
     def list_shares(self) -> list:
         """
@@ -168,53 +180,73 @@ class SmbSensitiveFileHunter(BaseSensitiveFileHunter):
         :return:
         """
         for name in self.shares:
-            try:
-                logger.debug("enumerate share: {}/{}".format(str(self.service), name))
-                self.__enumerate(name)
-            except Exception:
-                logger.error("cannot access share: {}/{}".format(str(self.service), name), exc_info=self._args.verbose)
+            logger.debug("enumerate share: %s/%s", self.service, name)
+        clients = [self.client] + [self._connect() for _ in range(self.connections - 1)]
+        # keep one tree connection per share open so that listPath and getFile reuse it instead of connecting to and
+        # disconnecting from the share for each call
+        trees = [(client, self._connect_tree(client, name)) for client in clients for name in self.shares]
+        self._enumerate_concurrently(clients, [(name, "/") for name in self.shares])
+        for client, tree_id in trees:
+            if tree_id is not None:
+                client.disconnectTree(tree_id)
+        # close the additional connections
+        for client in clients[1:]:
+            client.close()
 
-    def __enumerate(self, share: str, directory: str = "/") -> None:
+    def _connect_tree(self, client: SMBConnection, share: str):
+        """
+        This method connects the given client to the given share and returns the tree ID or None, if the share is not
+        accessible.
+        """
+        try:
+            return client.connectTree(share)
+        except impacket.smbconnection.SessionError:
+            logger.debug("cannot connect to share: %s/%s", self.service, share)
+        return None
+
+    def _enumerate_directory(self, client: SMBConnection, cwd: tuple, directories: Queue) -> None:
+        """
+        This method enumerates all files in the given share and directory and adds all subdirectories to the given
+        queue.
+        :return:
+        """
+        share, directory = cwd
         try:
-            items = self.client.listPath(share, self.pathify(directory))
+            items = client.listPath(share, self.pathify(directory))
+            utcfromtimestamp = datetime.datetime.utcfromtimestamp
+            prefix = directory if directory.endswith("/") else directory + "/"
             for item in items:
-                file_size = item.get_filesize()
                 filename = item.get_longname()
-                is_directory = item.is_directory()
                 if filename not in ['.', '..']:
-                    full_path = os.path.join(directory, filename)
-                    if is_directory:
-                        self.__enumerate(share, os.path.join(directory, filename))
+                    full_path = prefix + filename
+                    if item.is_directory():
+                        if filename in self.excluded_directories:
+                            logger.debug("skip excluded directory: %s", full_path)
+                        else:
+                            directories.put((share, full_path))
                     else:
-                        path = Path(service=self.service,
-                                    full_path=full_path,
-                                    share=share,
-                                    access_time=datetime.datetime.utcfromtimestamp(item.get_atime_epoch()),
-                                    modified_time=datetime.datetime.utcfromtimestamp(item.get_mtime_epoch()),
-                                    creation_time=datetime.datetime.utcfromtimestamp(item.get_ctime_epoch()))
-                        if self.is_file_size_below_threshold(path, file_size):
+                        file_size = item.get_filesize()
+                        path = create_path(self.service,
+                                           full_path=full_path,
+                                           share=share,
+                                           access_time=utcfromtimestamp(item.get_atime_epoch()),
+                                           modified_time=utcfromtimestamp(item.get_mtime_epoch()),
+                                           creation_time=utcfromtimestamp(item.get_ctime_epoch()))
+                        if self.is_known(path, file_size):
+                            logger.debug("skipping unchanged file: %s", path)
+                        elif self.is_file_size_below_threshold(path, file_size):
                             try:
                                 # Obtain file content
-                                with tempfile.NamedTemporaryFile(dir=self.temp_dir) as temp:
-                                    with open(temp.name, "wb") as file:
-                                        self.client.getFile(share, full_path, file.write, FILE_SHARE_READ)
-                                    with open(temp.name, "rb") as file:
-                                        content = file.read()
-                                path.file = File(content=content)
+                                receiver = ContentReceiver()
+                                client.getFile(share, full_path, receiver.write, FILE_SHARE_READ)
+                                set_file(path, receiver.get_file())
                                 # Add file to queue
-                                self.file_queue.put(path)
+                                self._enqueue(path)
                             except impacket.smbconnection.SessionError:
                                 # Catch permission exception, if SMB user does not have read permission on a certain file
-                                logger.error("cannot read file: {}".format(str(path)), exc_info=self._args.verbose)
+                                logger.error("cannot read file: %s", path, exc_info=self._args.verbose)
                         elif file_size > 0:
-                            path.file = File(content="[file ({}) not imported as file size ({}) "
-                                                     "is above threshold]".format(str(path), file_size).encode('utf-8'))
-                            path.file.size_bytes = file_size
-                            relevance = self._analyze_path_name(path)
-                            if self._args.debug and not relevance:
-                                logger.debug("ignoring file (threshold: above, size: {}): {}".format(file_size,
-                                                                                                     str(path)))
+                            self._analyze_path_above_threshold(path, file_size)
         except impacket.smbconnection.SessionError:
             # Catch permission exception, if SMB user does not have read permission on a certain directory
-            logger.error("cannot access item: {}/{}{}".format(str(self.service), share, str(directory)),
-                         exc_info=self._args.verbose)
+            logger.error("cannot access item: %s/%s%s", self.service, share, directory, exc_info=self._args.verbose)
@@ -24,6 +24,7 @@ __version__ = 0.1
 
 import unittest
 from database.core import Engine
+from database.model import DeclarativeBase
 from sqlalchemy.orm.session import Session
 
 
@@ -31,14 +32,23 @@ class BaseTestCase(unittest.TestCase):
     """
     This method implements all base functionalities for test cases
     """
+    # the test database is dropped and re-created only once per test run. afterwards, init_db just deletes its rows
+    _schema_created = False
+
     def __init__(self, test_name: str):
         super().__init__(test_name)
         self._engine = Engine(production=False)
         self._workspaces = ["test1", "test2"]
 
     def init_db(self):
-        self._engine.drop()
-        self._engine.init()
+        if BaseTestCase._schema_created:
+            with self._engine.engine.begin() as connection:
+                for table in reversed(DeclarativeBase.metadata.sorted_tables):
+                    connection.execute(table.delete())
+        else:
+            self._engine.drop()
+            self._engine.init()
+            BaseTestCase._schema_created = True
 
 
 class BaseDataModelTestCase(BaseTestCase):
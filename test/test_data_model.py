@@ -366,3 +366,19 @@ class TestMatchRule(BaseDataModelTestCase):
             self.assertEqual(MatchRuleAccuracy.high, file_match.accuracy)
             self.assertEqual(".*", file_match.search_pattern)
             self.assertEqual(30003, file_match.priority)
+
+    def test_compiled_search_patterns(self):
+        self.init_db()
+        with self._engine.session_scope() as session:
+            self._test_success(session,
+                               search_location=SearchLocation.file_content,
+                               category="test",
+                               relevance=FileRelevance.high,
+                               accuracy=MatchRuleAccuracy.high,
+                               search_pattern="pass")
+        with self._engine.session_scope() as session:
+            match_rule = session.query(MatchRule).one()
+            # rules loaded from the database compile their patterns lazily and share them with equal rules
+            self.assertIsNotNone(match_rule.search_pattern_re.search(b"PASSWORD"))
+            self.assertListEqual([(1, 5)], match_rule.get_text_markers("xPASSx"))
+            self.assertIs(MatchRule(search_pattern="pass").search_pattern_re, match_rule.search_pattern_re)